@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""Time each stage of charting a synthetic draw history.
+
+The input files are written by synthetic.py.  Each stage is timed
+separately as the best of several runs: reading the CSV files, filtering
+them by every combination of days, building the weekday index once and
+filtering every combination from it, building the charts of lotto.py and
+txt_lotto.py, and writing the largest chart with each writer.  The
+matplotlib writer is slow, so it is run once, and skipped if matplotlib
+is not installed.
+
+Timings can be saved as a JSON baseline.  A later run compared with the
+baseline fails if any stage is slower by more than the tolerance.
+
+Usage: python benchmarks/stages.py [--draws N] [--save FILE]
+                                   [--compare FILE]
+"""
+
+import argparse
+from collections import OrderedDict
+import datetime
+import importlib.util
+import json
+import os.path
+import platform
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import lotto  # noqa: E402
+import txt_lotto  # noqa: E402
+from drawcore import WeekdayIndex  # noqa: E402
+from synthetic import LAST_DATE, write_games  # noqa: E402
+
+
+def best_time(func, runs):
+    """Return the least wall time in seconds of runs calls of func, and
+    the result of the last call."""
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run_stages(directory, draws, num_range, weeks, dpi, runs):
+    """Return an ordered mapping of stage names to seconds taken, charting
+    synthetic files of draws draws written to directory."""
+    files = write_games(directory, draws, num_range)
+    timings = OrderedDict()
+
+    def stage(name, func, runs=runs):
+        timings[name], result = best_time(func, runs)
+        print('{:<24} {:.4f}s'.format(name, timings[name]))
+        return result
+
+    # lotto.py
+    results = stage('Reader.read_files', lambda: lotto.Reader(
+        list(files), False, False, num_range).read_files())
+    stage('filter_results', lambda: [
+        lotto.filter_results(results, days, weeks) for
+        days in lotto.DAY_COMBINATIONS])
+    index = stage('ResultsIndex', lambda: lotto.ResultsIndex(results))
+    combos = stage('ResultsIndex.filter', lambda: [
+        index.filter(days, weeks) for days in lotto.DAY_COMBINATIONS])
+    charts = stage('DrawChart', lambda: [
+        lotto.DrawChart(combo, num_range) for combo in combos if combo])
+    chart = max(charts, key=lambda c: len(c.body))
+    png = os.path.join(directory, 'chart.png')
+    stage('RasterWriter.write',
+          lambda: lotto.RasterWriter(chart, dpi).write(png))
+    if importlib.util.find_spec('matplotlib') is not None:
+        stage('Writer.write', lambda: lotto.Writer(chart, dpi).write(png),
+              runs=1)
+    else:
+        print('{:<24} skipped, matplotlib is not installed'.format(
+            'Writer.write'))
+
+    # txt_lotto.py
+    txt_lotto.OLDEST_DRAW = LAST_DATE - datetime.timedelta(weeks=weeks)
+    txt_draws = stage('LottoDraw.from_csv', lambda: [
+        draw for fn in files for draw in txt_lotto.LottoDraw.from_csv(fn)])
+    by_weekday = WeekdayIndex(txt_draws)
+    txt_charts = stage('LottoChart', lambda: [
+        txt_lotto.LottoChart(by_weekday.select(combo)) for
+        combo in txt_lotto.DRAW_COMBINATIONS])
+    combo, txt_chart = max(zip(txt_lotto.DRAW_COMBINATIONS, txt_charts),
+                           key=lambda pair: len(pair[1].rows))
+    html = os.path.join(directory, 'chart.html')
+    stage('HTMLWriter.save',
+          lambda: txt_lotto.HTMLWriter(txt_chart, combo).save(html))
+    text = os.path.join(directory, 'chart.txt')
+
+    def write_text():
+        with open(text, 'w') as f:
+            txt_lotto.TextWriter(txt_chart).write(f)
+    stage('TextWriter.write', write_text)
+    return timings
+
+
+def compare(timings, baseline, tolerance):
+    """Print each stage against the baseline and return the names of the
+    stages slower than it by more than tolerance."""
+    slower = []
+    print('\n{:<24} {:>10} {:>10} {:>7}'.format('stage', 'seconds',
+                                                'baseline', 'ratio'))
+    for name, seconds in timings.items():
+        base = baseline.get(name)
+        if not base:
+            print('{:<24} {:>9.4f}s {:>10}'.format(name, seconds, '-'))
+            continue
+        ratio = seconds / base
+        regressed = ratio > 1 + tolerance
+        if regressed:
+            slower.append(name)
+        print('{:<24} {:>9.4f}s {:>9.4f}s {:>6.2f}x{}'.format(
+            name, seconds, base, ratio, '  SLOWER' if regressed else ''))
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-d', '--draws', type=int, default=2000,
+                        help='draws in each synthetic file '
+                             '(default is 2000)')
+    parser.add_argument('-n', '--number-range', type=int, nargs=2,
+                        default=[1, 45], metavar=('LOW', 'HIGH'),
+                        help='the range of numbers drawn (default is 1 45)')
+    parser.add_argument('-w', '--weeks', type=int, default=104,
+                        help='weeks charted (default is 104)')
+    parser.add_argument('-r', '--resolution', type=int, default=120,
+                        metavar='DPI', help='image resolution '
+                                            '(default is 120)')
+    parser.add_argument('--runs', type=int, default=3,
+                        help='runs of each stage (default is 3)')
+    parser.add_argument('--save', metavar='FILE',
+                        help='save the timings as a JSON baseline')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare the timings with a JSON baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='fraction a stage may be slower than the '
+                             'baseline (default is 0.25)')
+    args = parser.parse_args()
+
+    params = OrderedDict([('draws', args.draws),
+                          ('number_range', args.number_range),
+                          ('weeks', args.weeks),
+                          ('dpi', args.resolution)])
+    with tempfile.TemporaryDirectory() as directory:
+        timings = run_stages(directory, args.draws, args.number_range,
+                             args.weeks, args.resolution, args.runs)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(OrderedDict([('params', params),
+                                   ('python', platform.python_version()),
+                                   ('stages', timings)]), f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('params') != params:
+            print('WARNING: baseline was run with {}'.format(
+                baseline.get('params')))
+        if compare(timings, baseline['stages'], args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""Check that the command line scripts start within a time budget.
+
+Each command is run several times in a fresh interpreter and fails the
+check if its median wall time exceeds the budget.  Importing the scripts
+must not import matplotlib or NumPy, which are only needed once a chart
+is drawn.
+
+Usage: python benchmarks/startup.py [--budget SECONDS] [--runs N]
+"""
+
+import argparse
+import os.path
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ('matplotlib', 'numpy', 'urllib.request')
+COMMANDS = (
+    ('lotto --help', ['lotto.py', '--help'], 0),
+    ('lotto bad argument', ['lotto.py', '--weeks', 'x', 'in.csv'], 2),
+    ('txt_lotto --help', ['txt_lotto.py', '--help'], 0),
+)
+
+
+def time_command(args, expected_status, runs):
+    """Return the median wall time in seconds of running args."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        status = subprocess.call([sys.executable] + args, cwd=ROOT,
+                                 stdout=subprocess.DEVNULL,
+                                 stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+        if status != expected_status:
+            raise RuntimeError('{} exited with {}, expected {}'.format(
+                ' '.join(args), status, expected_status))
+    return statistics.median(times)
+
+
+def heavy_imports(module):
+    """Return the heavy modules imported by importing module."""
+    code = ('import sys, {0}; print(" ".join(m for m in {1!r} '
+            'if m in sys.modules))'.format(module, HEAVY_MODULES))
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=ROOT)
+    return output.decode().split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--budget', type=float, default=0.25,
+                        help='maximum median seconds per command '
+                             '(default is 0.25)')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='runs of each command (default is 5)')
+    args = parser.parse_args()
+
+    failed = False
+    baseline = time_command(['-c', 'pass'], 0, args.runs)
+    print('{:<24} {:.3f}s'.format('python -c pass', baseline))
+    for name, command, status in COMMANDS:
+        elapsed = time_command(command, status, args.runs)
+        over = elapsed > args.budget
+        failed = failed or over
+        print('{:<24} {:.3f}s{}'.format(name, elapsed,
+                                        '  OVER BUDGET' if over else ''))
+    for module in ('lotto', 'txt_lotto'):
+        heavy = heavy_imports(module)
+        if heavy:
+            failed = True
+            print('import {} loads {}'.format(module, ', '.join(heavy)))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""Write synthetic draw histories in the Tatts CSV format.
+
+The files have the same layout as those published by Tatts: a heading
+row, then one row per draw of draw number, yyyymmdd date, winning numbers
+and supplementary numbers, oldest first.  Numbers are chosen with a
+seeded random generator, so the same arguments write the same files.
+
+Usage: python benchmarks/synthetic.py [options] DIRECTORY
+"""
+
+import argparse
+import datetime
+import os.path
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lotto import DAY_STRINGS, MON, TUE, WED, SAT, Reader  # noqa: E402
+
+# filename, draw days, winning numbers, supplementary numbers
+GAMES = (('Tattslotto.csv', (SAT,), 6, 2),
+         ('OzLotto.csv', (TUE,), 7, 2),
+         ('MondayWednesdayLotto.csv', (MON, WED), 6, 2))
+FIRST_DRAW_NUM = 1000
+LAST_DATE = datetime.date(2020, 12, 30)
+
+
+def draw_dates(weekdays, count, last_date=LAST_DATE):
+    """Return the count latest dates on or before last_date that fall on
+    weekdays, oldest first."""
+    dates = []
+    date = last_date
+    while len(dates) < count:
+        if date.weekday() in weekdays:
+            dates.append(date)
+        date -= datetime.timedelta(days=1)
+    dates.reverse()
+    return dates
+
+
+def write_history(filename, draws, weekdays, balls, supps,
+                  num_range=(1, 45), last_date=LAST_DATE, seed=0):
+    """Write a CSV file of draws draws on weekdays, each of balls winning
+    and supps supplementary numbers from num_range."""
+    if balls + supps > Reader.MAX_DRAWN_NUMBERS:
+        raise ValueError('at most {} numbers are read from a draw'.format(
+            Reader.MAX_DRAWN_NUMBERS))
+    lowest, highest = num_range
+    rng = random.Random(seed)
+    headings = (['Format: Draw Number', 'Draw Date (yyyymmdd)'] +
+                ['Winning Number {}'.format(i + 1) for i in range(balls)] +
+                ['Supplementary Number {}'.format(i + 1) for
+                 i in range(supps)])
+    with open(filename, 'w', newline='') as f:
+        f.write(','.join(headings) + '\r\n')
+        for i, date in enumerate(draw_dates(weekdays, draws, last_date)):
+            numbers = rng.sample(range(lowest, highest + 1), balls + supps)
+            f.write('{},{},{}\r\n'.format(FIRST_DRAW_NUM + i,
+                                          date.strftime('%Y%m%d'),
+                                          ','.join(map(str, numbers))))
+
+
+def write_games(directory, draws, num_range=(1, 45), games=GAMES,
+                last_date=LAST_DATE, seed=0):
+    """Write a history of draws draws for each game into directory and
+    return the filenames written."""
+    filenames = []
+    for i, (name, weekdays, balls, supps) in enumerate(games):
+        filename = os.path.join(directory, name)
+        write_history(filename, draws, weekdays, balls, supps, num_range,
+                      last_date, seed + i)
+        filenames.append(filename)
+    return filenames
+
+
+def parse_game(text):
+    """Return a game tuple from text in the format
+    NAME:DAYS:BALLS:SUPPS, where DAYS is like Mon,Wed."""
+    name, days, balls, supps = text.split(':')
+    day_numbers = {s.lower(): day for day, s in DAY_STRINGS.items()}
+    weekdays = tuple(day_numbers[day.lower()] for day in days.split(','))
+    return name, weekdays, int(balls), int(supps)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('directory', help='directory to write files to')
+    parser.add_argument('-d', '--draws', type=int, default=1000,
+                        help='draws in each file (default is 1000)')
+    parser.add_argument('-g', '--game', action='append', type=parse_game,
+                        metavar='NAME:DAYS:BALLS:SUPPS',
+                        help='a file to write, e.g. Tattslotto.csv:Sat:6:2 '
+                             '(default is Tattslotto, OzLotto and '
+                             'MondayWednesdayLotto)')
+    parser.add_argument('-n', '--number-range', type=int, nargs=2,
+                        default=[1, 45], metavar=('LOW', 'HIGH'),
+                        help='the range of numbers drawn (default is 1 45)')
+    parser.add_argument('-s', '--seed', type=int, default=0,
+                        help='random seed (default is 0)')
+    args = parser.parse_args()
+    for filename in write_games(args.directory, args.draws,
+                                args.number_range, args.game or GAMES,
+                                seed=args.seed):
+        print(filename)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""Serve charts of lottery draws over HTTP from memory.
+
+The input files are parsed once and kept in memory, indexed by weekday,
+along with the most recently requested charts: the DrawCharts in a
+ChartCache, shared by every format, and the bodies of the responses.
+Every request checks the sizes and modification times of the input
+files: when one changes the files are parsed again and the cached charts
+are dropped.  Repeat requests are answered from the cache without any
+charting.
+
+    GET /chart.json?days=Sat,Mon&weeks=104&low=1&high=45
+        the cells, colors, draw percentages and tallies of a DrawChart
+    GET /chart.png?days=Sat,Mon&weeks=104&low=1&high=45&dpi=120
+        the chart drawn by RasterWriter
+    GET /chart.html?days=Sat,Mon&weeks=104
+        the chart drawn by txt_lotto's HTMLWriter, of balls 1 to 45
+    GET /
+        links to the charts of every combination of days
+
+Usage: python chartserver.py [options] inputfiles...
+"""
+
+import argparse
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import logging
+import re
+import threading
+import urllib.parse
+
+from drawstore import source_signature
+import lotto
+import txt_lotto
+
+FORMATS = OrderedDict([('json', 'application/json'),
+                       ('png', 'image/png'),
+                       ('html', 'text/html; charset=utf-8')])
+DAY_NUMBERS = {name.lower(): day for day, name in lotto.DAY_STRINGS.items()}
+MIN_DPI, MAX_DPI = 10, 600
+
+
+class ChartService(object):
+    """Charts of the draws in a set of files, kept in a bounded least
+    recently used cache."""
+
+    def __init__(self, filenames, num_range, use_headings=False,
+                 cache_size=64, rules=None):
+        self.filenames = filenames
+        self.num_range = tuple(num_range)
+        self.use_headings = use_headings
+        self.cache_size = cache_size
+        self.rules = rules  # RuleSet for DrawChart, or None
+        self.lock = threading.Lock()
+        self.signature = None  # of the files self.index was read from
+        self.draw_charts = None  # ChartCache of the files' draws
+        self.charts = OrderedDict()  # key: body, least recent first
+
+    def history(self):
+        """Return the signature of the files, reading them again if they
+        changed."""
+        signature = source_signature(self.filenames, self.use_headings)
+        with self.lock:
+            if signature != self.signature:
+                logging.debug('Reading input files...')
+                # Reader drops the files it cannot read from its list
+                reader = lotto.Reader(list(self.filenames),
+                                      self.use_headings, False,
+                                      self.num_range)
+                try:
+                    results = reader.read_files()
+                except SystemExit:  # Reader's response to no draws at all
+                    raise IOError('no draws in the input files')
+                except ValueError as err:  # a malformed input file
+                    raise IOError('cannot read the input files: {}'.format(
+                        err))
+                self.draw_charts = lotto.ChartCache(
+                    lotto.ResultsIndex(results), self.cache_size, self.rules)
+                self.signature = signature
+                self.charts.clear()
+            return self.signature
+
+    def chart(self, fmt, days, weeks, num_range=None, dpi=120):
+        """Return the body of the chart of the draws on days in the last
+        weeks weeks, in format fmt.
+
+        Raises:
+            LookupError: if no draws fall on one of days.
+            IOError: if the input files cannot be read.
+
+        """
+        num_range = self.num_range if num_range is None else num_range
+        signature = self.history()
+        # HTML charts are always of balls 1 to 45, and only images have
+        # a resolution
+        key = (fmt, tuple(days), weeks,
+               None if fmt == 'html' else tuple(num_range),
+               dpi if fmt == 'png' else None)
+        with self.lock:
+            if signature == self.signature and key in self.charts:
+                self.charts.move_to_end(key)
+                return self.charts[key]
+            draw_charts = self.draw_charts
+        chart = draw_charts.chart(days, weeks, num_range)
+        if chart is None:
+            raise LookupError('no draws on every one of these days')
+        body = RENDERERS[fmt](chart, days, weeks, dpi)
+        with self.lock:
+            if signature == self.signature:
+                self.charts[key] = body
+                while len(self.charts) > self.cache_size:
+                    self.charts.popitem(last=False)
+        return body
+
+
+def render_json(chart, days, weeks, dpi):
+    """Return the JSON of a DrawChart."""
+    start, text_cols = chart.HEADER_HEIGHT, chart.TEXT_COLS
+    rows = [OrderedDict([('date', row[0].isoformat()),
+                         ('file', row[1]),
+                         ('drawn', row[text_cols:]),
+                         ('colors', list(colors[text_cols:]))]) for
+            row, colors in zip(chart.body, chart.colors[start:])]
+    return json.dumps(OrderedDict([
+        ('days', [lotto.DAY_STRINGS[day] for day in days]),
+        ('weeks', weeks),
+        ('number_range', [chart.lowest, chart.highest]),
+        ('numbers', chart.header[0][text_cols:]),
+        ('rows', rows),
+        ('draw_percentages', chart.footer[0][text_cols:]),
+        ('tallies', OrderedDict((row[1], list(row[text_cols:])) for
+                                row in chart.footer[1:]))])).encode()
+
+
+def render_png(chart, days, weeks, dpi):
+    """Return the PNG image of a DrawChart."""
+    f = io.BytesIO()
+    lotto.RasterWriter(chart, dpi).write_file(f)
+    return f.getvalue()
+
+
+def render_html(chart, days, weeks, dpi):
+    """Return the HTML page of the LottoChart of the draws of a
+    DrawChart."""
+    draws = sorted((draw for draws in chart.results.values() for
+                    draw in draws), key=lambda draw: draw.ordinal)
+    lotto_chart = txt_lotto.LottoChart(draws, stream=True)
+    writer = txt_lotto.HTMLWriter(lotto_chart, days)
+    return ''.join(writer.chunks()).encode()
+
+
+RENDERERS = {'json': render_json, 'png': render_png, 'html': render_html}
+
+
+def parse_query(query, default_weeks=104):
+    """Return the keyword arguments of ChartService.chart given in a URL
+    query string.
+
+    Raises:
+        ValueError: if an argument is missing or invalid.
+
+    """
+    params = urllib.parse.parse_qs(query)
+
+    def param(name, default=None):
+        values = params.get(name)
+        if not values:
+            if default is None:
+                raise ValueError('{} is required'.format(name))
+            return default
+        return values[-1]
+
+    try:
+        days = tuple(DAY_NUMBERS[day.strip().lower()] for
+                     day in param('days').split(','))
+    except KeyError as err:
+        raise ValueError('unknown day {}'.format(err))
+    if len(set(days)) < len(days):
+        raise ValueError('days are repeated')
+    if ('low' in params) != ('high' in params):
+        raise ValueError('low and high must be given together')
+    try:
+        weeks = int(param('weeks', default_weeks))
+        dpi = int(param('dpi', 120))
+        num_range = None
+        if 'low' in params:
+            num_range = (int(param('low')), int(param('high')))
+    except ValueError:
+        raise ValueError('weeks, low, high and dpi must be integers')
+    if weeks < 0:
+        raise ValueError('weeks must not be negative')
+    if not MIN_DPI <= dpi <= MAX_DPI:
+        raise ValueError('dpi must be from {} to {}'.format(MIN_DPI, MAX_DPI))
+    if num_range is not None and not 0 <= num_range[0] <= num_range[1] < 64:
+        raise ValueError('need 0 <= low <= high < 64')
+    return {'days': days, 'weeks': weeks, 'num_range': num_range,
+            'dpi': dpi}
+
+
+def index_page():
+    """Return the HTML of the links to every combination of days."""
+    links = []
+    for days in lotto.DAY_COMBINATIONS:
+        query = 'days=' + ','.join(lotto.DAY_STRINGS[day] for day in days)
+        names = ' '.join(lotto.DAY_STRINGS[day] for day in days)
+        anchors = ' '.join("<a href='/chart.{0}?{1}'>{0}</a>".format(
+            fmt, query) for fmt in FORMATS)
+        links.append('<p>{} {}</p>'.format(names, anchors))
+    return ('<html><body><h1>Lotto charts</h1>\n' + '\n'.join(links) +
+            '\n</body></html>\n').encode()
+
+
+class ChartHandler(BaseHTTPRequestHandler):
+    """Answers GET requests with charts from the server's ChartService."""
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == '/':
+            self.send_body(index_page(), FORMATS['html'])
+            return
+        match = re.fullmatch(r'/chart\.(\w+)', url.path)
+        if match is None or match.group(1) not in FORMATS:
+            self.send_error(404)
+            return
+        try:
+            body = self.server.service.chart(
+                match.group(1), **parse_query(url.query, self.server.weeks))
+        except ValueError as err:
+            self.send_error(400, str(err))
+        except LookupError as err:
+            self.send_error(404, str(err))
+        except IOError as err:
+            self.send_error(503, str(err))
+        else:
+            self.send_body(body, FORMATS[match.group(1)])
+
+    def send_body(self, body, content_type):
+        """Send a 200 response with body."""
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug('%s - %s', self.address_string(), format % args)
+
+
+def serve(service, host='localhost', port=8000, weeks=104):
+    """Serve the charts of service until interrupted."""
+    server = ThreadingHTTPServer((host, port), ChartHandler)
+    server.service = service
+    server.weeks = weeks  # default of requests that give no weeks
+    print('Serving charts on http://{}:{}/'.format(*server.server_address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('inputfiles', nargs='+',
+                        help='CSV file(s) to chart')
+    parser.add_argument('-b', '--bind', default='localhost', metavar='HOST',
+                        help='address to listen on (default is localhost)')
+    parser.add_argument('-p', '--port', type=int, default=8000,
+                        help='port to listen on (default is 8000)')
+    parser.add_argument('-u', '--use-headings', action='store_true',
+                        help='read CSV columns by their headings '
+                             'rather than their order')
+    parser.add_argument('-n', '--number-range', type=int, nargs=2,
+                        default=[1, 45], metavar=('LOW', 'HIGH'),
+                        help='the range of numbers charted when a request '
+                             'gives none (default is 1 45)')
+    parser.add_argument('-w', '--weeks', type=int, default=104,
+                        help='weeks charted when a request gives none '
+                             '(default is 104)')
+    parser.add_argument('--cache-size', type=int, default=64, metavar='N',
+                        help='charts kept in memory (default is 64)')
+    parser.add_argument('--rules', metavar='FILE',
+                        help='color drawn numbers by the rules in the JSON '
+                             'file FILE')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='log every request')
+    args = parser.parse_args()
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    rules = None
+    if args.rules:
+        try:
+            rules = lotto.read_rules(args.rules)
+        except (IOError, ValueError) as err:
+            parser.error('argument --rules: {}'.format(err))
+    service = ChartService(args.inputfiles, sorted(args.number_range),
+                           args.use_headings, args.cache_size, rules)
+    serve(service, args.bind, args.port, args.weeks)
+
+
+if __name__ == '__main__':
+    main()
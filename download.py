@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""Keep local copies of draw archives up to date over HTTP.
+
+Each archive is fetched in its own thread.  The ETag, Last-Modified date
+and size of the last copy downloaded are kept in a state file beside it,
+so a refresh sends a conditional request that the server can answer with
+304 Not Modified.  Archives only grow at the end, so when one has changed
+only the bytes after the local copy are requested, with a range that
+overlaps the end of the copy: if the overlap differs the archive was not
+just appended to and is downloaded again in full.  Bodies are streamed
+to disk.
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+import urllib.error
+import urllib.request
+
+from drawcore import replace_file
+
+STATE_EXT = '.download'
+OVERLAP = 256  # bytes of the local copy requested again as a check
+CHUNK_SIZE = 1 << 16
+TIMEOUT = 60  # seconds
+
+# outcomes of fetch()
+UNCHANGED = 'unchanged'
+APPENDED = 'appended'
+DOWNLOADED = 'downloaded'
+
+
+def fetch_all(base_url, filenames, directory='.', jobs=None):
+    """Bring every file in filenames up to date from base_url at once.
+
+    Returns:
+        list of (str, str): each filename and the outcome of fetch().
+
+    """
+    base_url = base_url.rstrip('/') + '/'
+    with ThreadPoolExecutor(jobs or len(filenames) or 1) as executor:
+        futures = [executor.submit(fetch, base_url + fn,
+                                   os.path.join(directory, fn)) for
+                   fn in filenames]
+        return [(fn, future.result()) for fn, future in
+                zip(filenames, futures)]
+
+
+def fetch(url, filename):
+    """Bring filename up to date with url and return one of UNCHANGED,
+    APPENDED or DOWNLOADED."""
+    state = read_state(filename)
+    size = local_size(filename)
+    if state is None or state.get('url') != url or size != state.get('size'):
+        return download(url, filename)
+
+    start = max(size - OVERLAP, 0)
+    headers = {'Range': 'bytes={}-'.format(start)}
+    if state.get('etag'):
+        headers['If-None-Match'] = state['etag']
+    if state.get('last_modified'):
+        headers['If-Modified-Since'] = state['last_modified']
+    try:
+        response = urllib.request.urlopen(
+            urllib.request.Request(url, headers=headers), timeout=TIMEOUT)
+    except urllib.error.HTTPError as err:
+        if err.code == 304:
+            return UNCHANGED
+        if err.code == 416:  # the archive is now shorter than the copy
+            return download(url, filename)
+        raise
+    with response:
+        if response.status != 206:  # the range was ignored
+            write_replacing(response, filename)
+            write_state(filename, url, response)
+            return DOWNLOADED
+        if range_start(response) != start:
+            response.close()
+            return download(url, filename)
+        overlap = response.read(size - start)
+        with open(filename, 'rb') as f:
+            f.seek(start)
+            if f.read() != overlap:
+                logging.debug('{} was rewritten'.format(url))
+                response.close()
+                return download(url, filename)
+        with open(filename, 'ab') as f:
+            appended = copy_stream(response, f)
+    write_state(filename, url, response)
+    return APPENDED if appended else UNCHANGED
+
+
+def download(url, filename):
+    """Download the whole of url to filename and return DOWNLOADED."""
+    with urllib.request.urlopen(url, timeout=TIMEOUT) as response:
+        write_replacing(response, filename)
+    write_state(filename, url, response)
+    return DOWNLOADED
+
+
+def write_replacing(response, filename):
+    """Stream the body of response to a temporary file, then replace
+    filename with it."""
+    with replace_file(filename) as f:
+        copy_stream(response, f)
+
+
+def copy_stream(response, f):
+    """Copy the rest of the body of response to f in chunks and return
+    the number of bytes copied."""
+    copied = 0
+    while True:
+        chunk = response.read(CHUNK_SIZE)
+        if not chunk:
+            return copied
+        f.write(chunk)
+        copied += len(chunk)
+
+
+def range_start(response):
+    """Return the first byte offset in the Content-Range of response, or
+    None if it has none."""
+    content_range = response.headers.get('Content-Range', '')
+    unit, _, byte_range = content_range.partition(' ')
+    try:
+        return int(byte_range.split('-')[0]) if unit == 'bytes' else None
+    except ValueError:
+        return None
+
+
+def local_size(filename):
+    """Return the size of filename, or None if it does not exist."""
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return None
+
+
+def read_state(filename):
+    """Return the state saved when filename was last fetched, or None."""
+    try:
+        with open(filename + STATE_EXT) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def write_state(filename, url, response):
+    """Save the validators of response and the size of filename."""
+    state = {'url': url,
+             'etag': response.headers.get('ETag'),
+             'last_modified': response.headers.get('Last-Modified'),
+             'size': os.path.getsize(filename)}
+    with open(filename + STATE_EXT, 'w') as f:
+        json.dump(state, f)
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""Binary columnar cache for draws parsed from CSV files.
+
+Each cache file holds the draws read from one source file by one parser
+as three columns: draw numbers and date ordinals as 32-bit integers, and
+number bitmasks as 64-bit words.  The header records the size and
+modification time of the source, so a cache is only used while the
+source is unchanged.  Valid caches are memory-mapped rather than read.
+
+Draw history files only grow at the end, so the header also records the
+last draw number read and a checksum of the bytes just before the end of
+the source.  When the source has grown and those bytes are unchanged,
+only the appended rows are parsed and added to the cache.  Only parsing
+is incremental: a chart covers the weeks up to its latest draw, so new
+draws move where it starts and it is built again from the cached draws.
+
+"""
+
+from array import array
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+from drawcore import Draw, replace_file
+
+MAGIC = b'LOTC'
+VERSION = 2
+# magic, version, byte order, mask words, draw count, source size,
+# source mtime (ns), last draw number, source key digest, tail checksum
+HEADER = struct.Struct('=4sBBHIqqq20sI')
+BYTE_ORDERS = {'little': 0, 'big': 1}
+NO_DRAW_NUM = -1  # stored in place of a missing draw number
+WORD_BITS = 64
+TAIL_BYTES = 256  # bytes of the source checked before appending to it
+
+
+class DrawCache(object):
+    """A directory of cached draw columns, one file per source and
+    parser."""
+    EXT = '.draws'
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def read(self, source, parser, parse, draw_type=Draw,
+             parse_appended=None):
+        """Return the draws for source, calling parse() to read them from
+        the source if the cache is missing or stale.
+
+        Args:
+            source (str): path of the source file
+            parser (str): identifies how parse() interprets the source,
+                so different parsers of one file get separate caches
+            parse (callable): returns a list of draws read from source
+            draw_type (class): Draw subclass to return cached draws as
+            parse_appended (callable): given a byte offset, returns a list
+                of the draws in the rows of source after that offset
+
+        """
+        stat = os.stat(source)
+        cached = self.load(source, parser, draw_type)
+        if cached is not None:
+            draws, entry = cached
+            if entry.matches(stat):
+                return draws
+            if parse_appended is not None and entry.appended_to(source, stat):
+                new_draws = [draw for draw in parse_appended(entry.size) if
+                             entry.precedes(draw)]
+                logging.debug('Read {} new draws from {}'.format(
+                    len(new_draws), source))
+                draws.extend(new_draws)
+                self.store(source, parser, draws, stat)
+                return draws
+        draws = parse()
+        self.store(source, parser, draws, stat)
+        return draws
+
+    def path(self, source, parser):
+        """Return the cache filename for source read by parser."""
+        return os.path.join(self.directory,
+                            key_digest(source, parser).hex() + self.EXT)
+
+    def load(self, source, parser, draw_type=Draw):
+        """Return the cached draws for source and the CacheEntry describing
+        the source they were read from, or None if there is no cache."""
+        filename = self.path(source, parser)
+        try:
+            with open(filename, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    return self.decode(mm, source, parser, draw_type)
+        except (IOError, ValueError, struct.error) as err:
+            logging.debug('No usable cache {}: {}'.format(filename, err))
+            return None
+
+    def decode(self, buffer, source, parser, draw_type):
+        """Return the draws and CacheEntry stored in buffer, or None if it
+        does not hold a cache of source read by parser."""
+        (magic, version, byte_order, words, count, size, mtime,
+            last_draw_num, digest, tail_crc) = HEADER.unpack_from(buffer)
+        if (magic != MAGIC or version != VERSION or
+                byte_order != BYTE_ORDERS[sys.byteorder] or
+                digest != key_digest(source, parser)):
+            return None
+        with memoryview(buffer) as view:
+            draw_nums, end = read_column(view, 'i', HEADER.size, count)
+            ordinals, end = read_column(view, 'i', end, count)
+            masks, end = read_column(view, 'Q', end, count * words)
+        draws = [draw_type.from_mask(None if draw_num == NO_DRAW_NUM else
+                                     draw_num, ordinal,
+                                     join_words(masks, i, words))
+                 for i, (draw_num, ordinal) in
+                 enumerate(zip(draw_nums, ordinals))]
+        entry = CacheEntry(size, mtime, None if last_draw_num == NO_DRAW_NUM
+                           else last_draw_num, tail_crc)
+        return draws, entry
+
+    def store(self, source, parser, draws, stat):
+        """Write draws to the cache for source, ignoring failures."""
+        try:
+            tail_crc = read_tail_crc(source, stat.st_size)
+            os.makedirs(self.directory, exist_ok=True)
+            with replace_file(self.path(source, parser)) as f:
+                f.write(encode(draws, key_digest(source, parser), stat,
+                               tail_crc))
+        except (IOError, OverflowError) as err:
+            logging.debug('Cannot cache {}: {}'.format(source, err))
+
+
+class CacheEntry(object):
+    """The state of a source file when it was cached."""
+
+    def __init__(self, size, mtime, last_draw_num, tail_crc):
+        self.size = size
+        self.mtime = mtime
+        self.last_draw_num = last_draw_num
+        self.tail_crc = tail_crc
+
+    def matches(self, stat):
+        """Return True if the source is unchanged."""
+        return self.size == stat.st_size and self.mtime == stat.st_mtime_ns
+
+    def appended_to(self, source, stat):
+        """Return True if the source looks to have only had rows appended
+        since it was cached."""
+        return (stat.st_size > self.size and
+                read_tail_crc(source, self.size) == self.tail_crc)
+
+    def precedes(self, draw):
+        """Return True if draw comes after the last cached draw."""
+        return (self.last_draw_num is None or draw.draw_num is None or
+                draw.draw_num > self.last_draw_num)
+
+
+def key_digest(source, parser):
+    """Return a digest identifying source read by parser."""
+    key = '\0'.join((os.path.abspath(source), parser))
+    return hashlib.sha1(key.encode('utf-8')).digest()
+
+
+def read_tail_crc(source, size):
+    """Return the checksum of the bytes of source just before offset size,
+    or None if they do not end a line."""
+    start = max(size - TAIL_BYTES, 0)
+    with open(source, 'rb') as f:
+        f.seek(start)
+        tail = f.read(size - start)
+    if not tail.endswith(b'\n'):
+        return None
+    return zlib.crc32(tail)
+
+
+def encode(draws, digest, stat, tail_crc):
+    """Return the bytes of a cache file holding draws."""
+    widest = max((draw.mask.bit_length() for draw in draws), default=0)
+    words = max(1, -(-widest // WORD_BITS))
+    draw_nums = array('i', (NO_DRAW_NUM if draw.draw_num is None else
+                            draw.draw_num for draw in draws))
+    ordinals = array('i', (draw.ordinal for draw in draws))
+    masks = array('Q')
+    for draw in draws:
+        masks.extend(split_words(draw.mask, words))
+    draw_nums_read = [draw.draw_num for draw in draws if
+                      draw.draw_num is not None]
+    last_draw_num = max(draw_nums_read, default=NO_DRAW_NUM)
+    header = HEADER.pack(MAGIC, VERSION, BYTE_ORDERS[sys.byteorder], words,
+                         len(draws), stat.st_size, stat.st_mtime_ns,
+                         last_draw_num, digest,
+                         0 if tail_crc is None else tail_crc)
+    return b''.join((header, draw_nums.tobytes(), ordinals.tobytes(),
+                     masks.tobytes()))
+
+
+def read_column(view, typecode, start, count):
+    """Return an array of count items of typecode copied out of view from
+    byte offset start, and the offset of the byte after them."""
+    column = array(typecode)
+    end = start + count * column.itemsize
+    if end > len(view):
+        raise ValueError('truncated cache file')
+    with view[start:end] as chunk:
+        column.frombytes(chunk)
+    return column, end
+
+
+def split_words(mask, words):
+    """Return mask as a list of words, least significant first."""
+    word_mask = (1 << WORD_BITS) - 1
+    return [mask >> (WORD_BITS * i) & word_mask for i in range(words)]
+
+
+def join_words(masks, i, words):
+    """Return the i-th mask stored in masks as words words."""
+    if words == 1:
+        return masks[i]
+    start = i * words
+    return sum(masks[start + w] << (WORD_BITS * w) for w in range(words))
@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+"""Draw processing shared by lotto.py and txt_lotto.py."""
+
+import bisect
+from collections import OrderedDict
+import contextlib
+import datetime
+import functools
+import hashlib
+import heapq
+from operator import attrgetter
+import os
+import tempfile
+
+MAX_INT64_BITS = 63  # bits of a mask held in a signed int64
+UMASK = os.umask(0)  # read once at import: os.umask cannot only query it
+os.umask(UMASK)
+
+
+# ----- Functions ------
+
+@functools.lru_cache(maxsize=None)
+def load_numpy():
+    """Return the numpy module, or None if it is not installed.
+
+    NumPy is imported on first use so that runs which never need it do
+    not pay for the import.  Without it, charts are built and files are
+    parsed in pure Python.
+
+    """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+@contextlib.contextmanager
+def replace_file(path, mode='wb'):
+    """Yield a temporary file in the directory of path, opened with mode,
+    that replaces path when the block exits without error.  An
+    interrupted write never leaves a partial file at path."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                               suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            os.chmod(tmp, 0o666 & ~UMASK)  # as open() would create it
+            yield f
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def numbers_mask(numbers):
+    """Return an integer with bit n set for every number n in numbers."""
+    mask = 0
+    for n in numbers:
+        mask |= 1 << n
+    return mask
+
+
+def mask_numbers(mask):
+    """Return a sorted list of the numbers whose bits are set in mask."""
+    numbers = []
+    while mask:
+        lowest_bit = mask & -mask
+        numbers.append(lowest_bit.bit_length() - 1)
+        mask ^= lowest_bit
+    return numbers
+
+
+def range_mask(num_range):
+    """Return a mask with the bits of every number in num_range set."""
+    lowest, highest = num_range
+    return ((1 << (highest - lowest + 1)) - 1) << lowest
+
+
+def drawn_matrix(draws, num_range):
+    """Return a NumPy array of booleans with a row for each of draws and a
+    column for each number in num_range, True where the draw holds the
+    number, or None if NumPy is not installed or the numbers do not fit
+    in an int64."""
+    np = load_numpy()
+    lowest, highest = num_range
+    if np is None or highest >= MAX_INT64_BITS:
+        return None
+    in_range = range_mask(num_range)
+    masks = np.fromiter((draw.mask & in_range for draw in draws), np.int64,
+                        len(draws))
+    numbers = np.arange(lowest, highest + 1, dtype=np.int64)
+    return (masks[:, None] >> numbers & 1).astype(bool)
+
+
+def draws_digest(rows, *params):
+    """Return a hex digest identifying a sequence of (label, Draw) rows and
+    any other parameters that affect how they are presented."""
+    digest = hashlib.sha1(repr(params).encode('utf-8'))
+    for label, draw in rows:
+        digest.update('{}|{}|{}|{:x}\n'.format(
+            label, draw.draw_num, draw.ordinal, draw.mask).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def color_tallies(counts, draw_count, not_drawn):
+    """Return a mapping of each color to its count in every column.
+
+    counts maps each color given to drawn numbers to its counts, and the
+    count of not_drawn is what remains of draw_count in each column.
+
+    """
+    tallies = OrderedDict((color, list(column_counts)) for
+                          color, column_counts in counts.items())
+    drawn_counts = [sum(column) for column in zip(*counts.values())]
+    if not_drawn in tallies:
+        # not_drawn doubles as the color of some drawn numbers
+        tallies[not_drawn] = [
+            tally + draw_count - drawn_count for tally, drawn_count
+            in zip(tallies[not_drawn], drawn_counts)]
+    else:
+        tallies[not_drawn] = [draw_count - drawn_count for
+                              drawn_count in drawn_counts]
+    return tallies
+
+
+# ------ Classes -------
+
+class Draw(object):
+    """A set of numbers identified by a date and draw number.
+
+    The numbers are held as an integer bitmask and the date as its
+    proleptic Gregorian ordinal, so a draw costs three small integers.
+
+    """
+    __slots__ = ('draw_num', 'ordinal', 'mask')
+
+    def __init__(self, draw_num, date, numbers):
+        self.draw_num = draw_num
+        self.ordinal = date.toordinal()
+        self.mask = numbers_mask(numbers)
+
+    @classmethod
+    def from_mask(cls, draw_num, ordinal, mask):
+        """Return a draw built from its stored integer fields."""
+        draw = cls.__new__(cls)
+        draw.draw_num = draw_num
+        draw.ordinal = ordinal
+        draw.mask = mask
+        return draw
+
+    @property
+    def date(self):
+        """Return the date of the draw as a datetime.date."""
+        return datetime.date.fromordinal(self.ordinal)
+
+    @property
+    def weekday(self):
+        """Return the day of the week, the same as date.weekday()."""
+        return (self.ordinal + 6) % 7
+
+    @property
+    def numbers(self):
+        """Return a sorted list of the numbers drawn."""
+        return mask_numbers(self.mask)
+
+    def __contains__(self, n):
+        return n >= 0 and bool(self.mask >> n & 1)
+
+    def __len__(self):
+        return bin(self.mask).count('1')
+
+    def __eq__(self, other):
+        if not isinstance(other, Draw):
+            return NotImplemented
+        return ((self.draw_num, self.ordinal, self.mask) ==
+                (other.draw_num, other.ordinal, other.mask))
+
+    def __hash__(self):
+        return hash((self.draw_num, self.ordinal, self.mask))
+
+    def __lt__(self, other):
+        """A draw is less than other if its date is earlier."""
+        return self.ordinal < other.ordinal
+
+    def __repr__(self):
+        return 'Draw(draw_num={!r}, date={!r}, numbers={!r})'.format(
+            self.draw_num, self.date, self.numbers)
+
+
+class RuleSet(object):
+    """Color rules compiled into lookup tables.
+
+    Rules are an ordered mapping of rule tuples to colors in the format
+    of DrawChart.COLOR_RULES, of any length: each tuple holds the
+    required state of a number in the previous draw at position 0,
+    earlier draws at higher indexes, and the first rule matched gives the
+    color.  The state of a number before a draw is a bitmask of whether
+    it was drawn in each of the previous depth draws, bit 0 for the
+    previous draw.  Every state is matched against the rules once, here,
+    so coloring a drawn number is one lookup of its state in a table
+    however many rules there are.
+
+    """
+    MAX_DEPTH = 16  # the tables hold 2 ** (depth + 1) states
+
+    def __init__(self, rules, names=None):
+        """rules: ordered mapping of rule tuples to colors
+        names: optional ordered mapping of colors to the names of their
+        tallies
+        """
+        self.rules = OrderedDict((tuple(bool(required) for
+                                        required in rule), color) for
+                                 rule, color in rules.items())
+        self.names = OrderedDict(names or ())
+        self.depth = max((len(rule) for rule in self.rules), default=0)
+        if self.depth > self.MAX_DEPTH:
+            raise ValueError('rules may look back at most {} draws'.format(
+                self.MAX_DEPTH))
+        self.colors = list(OrderedDict.fromkeys(self.rules.values()))
+        # tables[h] colors the states of a number when only h draws came
+        # before it, so rules longer than h are skipped
+        self.tables = [self.compile(history) for
+                       history in range(self.depth + 1)]
+
+    def compile(self, history):
+        """Return a list of the color of every state of the previous
+        history draws, or None where no rule matches."""
+        matchers = []
+        for rule, color in self.rules.items():
+            if len(rule) <= history:
+                bits = sum(1 << i for i, required in enumerate(rule) if
+                           required)
+                matchers.append(((1 << len(rule)) - 1, bits, color))
+        table = []
+        for state in range(1 << history):
+            for rule_mask, bits, color in matchers:
+                if state & rule_mask == bits:
+                    table.append(color)
+                    break
+            else:
+                table.append(None)
+        return table
+
+    def table(self, history):
+        """Return the table for a draw with history draws before it."""
+        return self.tables[min(history, self.depth)]
+
+
+class ColorEngine(object):
+    """Colors and running tallies for a stream of draws.
+
+    Rules are a RuleSet, or an ordered mapping of rule tuples to colors to
+    compile into one.  The state of every number in the last
+    RuleSet.depth draws is kept as a small bitmask, updated only when the
+    number is drawn, so pushing a draw costs one table lookup per number
+    drawn.
+
+    """
+
+    def __init__(self, rules, num_range, drawn, not_drawn, min_history=0):
+        """rules: RuleSet or ordered mapping of rule tuples to colors
+        num_range: (lowest, highest) numbers to color, inclusive
+        drawn: color of a drawn number that matches no rule
+        not_drawn: color of a number that was not drawn
+        min_history: leave drawn numbers uncolored until this many
+        earlier draws have been seen
+        """
+        if not isinstance(rules, RuleSet):
+            rules = RuleSet(rules)
+        self.rules = rules
+        self.lowest, self.highest = num_range
+        self.width = self.highest - self.lowest + 1
+        self.drawn = drawn
+        self.not_drawn = not_drawn
+        self.min_history = min_history
+        self.range_mask = range_mask(num_range)
+        # the state of each number after the draw it was last drawn in,
+        # with bit 0 for that draw, and the draw_count of that draw
+        self._states = [0] * self.width
+        self._last_drawn = [-1 - rules.depth] * self.width  # draw_count
+        self._full_state = (1 << rules.depth) - 1
+        self.draw_count = 0
+        self._counts = OrderedDict()
+        for color in rules.colors + [drawn]:
+            self._counts.setdefault(color, [0] * self.width)
+
+    @property
+    def tallies(self):
+        """Return a mapping of each color to its count in every column."""
+        return color_tallies(self._counts, self.draw_count, self.not_drawn)
+
+    def classify(self, mask):
+        """Return a list of (color, mask) pairs that partition the numbers
+        of the draw given by mask, then advance to the next draw."""
+        classes = OrderedDict()
+        for col, color in self.color_columns(mask):
+            classes[color] = classes.get(color, 0) | 1 << col + self.lowest
+        return list(classes.items())
+
+    def push(self, mask):
+        """Return the color of every number in range for the draw given by
+        mask, and add them to the running tallies."""
+        row = [self.not_drawn] * self.width
+        counts = self._counts
+        for col, color in self.color_columns(mask):
+            row[col] = color
+            counts[color][col] += 1
+        return row
+
+    def color_columns(self, mask):
+        """Return a list of the (column, color) of every number in range
+        of the draw given by mask, then advance to the next draw."""
+        draw_count = self.draw_count
+        depth = self.rules.depth
+        full = self._full_state
+        table = self.rules.table(draw_count)
+        ruled = draw_count >= self.min_history
+        states, last_drawn = self._states, self._last_drawn
+        columns = []
+        for n in mask_numbers(mask & self.range_mask):
+            col = n - self.lowest
+            gap = draw_count - 1 - last_drawn[col]  # draws since then
+            state = states[col] << gap & full if gap < depth else 0
+            color = table[state] if ruled else None
+            columns.append((col, self.drawn if color is None else color))
+            states[col] = (state << 1 | 1) & full
+            last_drawn[col] = draw_count
+        self.draw_count += 1
+        return columns
+
+
+class WeekdayIndex(object):
+    """Draws bucketed by weekday, with each bucket sorted by date.
+
+    Selecting the draws on a combination of days after a cutoff date is
+    a bisect into each bucket and a merge of the sorted tails, rather
+    than a scan of every draw.
+
+    """
+
+    def __init__(self, draws):
+        self.buckets = {}
+        for draw in draws:
+            self.buckets.setdefault(draw.weekday, []).append(draw)
+        self.ordinals = {}
+        for day, bucket in self.buckets.items():
+            bucket.sort(key=attrgetter('ordinal'))  # stable for equal dates
+            self.ordinals[day] = [draw.ordinal for draw in bucket]
+
+    def days(self):
+        """Return the set of weekdays with at least one draw."""
+        return set(self.buckets)
+
+    def last_ordinal(self, days):
+        """Return the ordinal of the latest draw on days, or None."""
+        return max((self.ordinals[day][-1] for day in days if
+                    day in self.ordinals), default=None)
+
+    def select(self, days, after=None):
+        """Return a list of the draws on days, sorted by date, that are
+        later than the date ordinal after if it is given."""
+        tails = []
+        for day in days:
+            if day not in self.buckets:
+                continue
+            start = 0
+            if after is not None:
+                start = bisect.bisect_right(self.ordinals[day], after)
+            tails.append(self.buckets[day][start:])
+        if len(tails) == 1:
+            return tails[0]
+        return list(heapq.merge(*tails, key=attrgetter('ordinal')))
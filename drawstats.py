@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""Per-number statistics for a sequence of draws.
+
+With NumPy, every statistic is computed a column at a time from the
+(draws x numbers) matrix of drawn numbers that DrawChart also charts:
+counts are column sums, gaps come from the last row each number is set
+in, and streaks are the distances between the rising and falling edges
+of each column.  Without it they are gathered in one pass that visits
+only the numbers each draw contains, by walking the set bits of its
+mask: a run of draws without a number is the distance between two draws
+that contain it.
+
+RollingWindow keeps counts and color tallies for a window sliding over
+the draws, updated as draws enter and leave it, so a series of windows
+costs time linear in the history rather than window x history.
+
+"""
+
+from collections import deque, OrderedDict
+import datetime
+import itertools
+from operator import attrgetter
+
+from drawcore import (ColorEngine, color_tallies, drawn_matrix, load_numpy,
+                      mask_numbers, range_mask)
+
+
+class NumberStats(object):
+    """Frequency, gap and streak statistics for every number in a range.
+
+    Draws must be in date order.  Lists are indexed by number - lowest:
+        counts: draws each number appeared in
+        window_counts: as counts, within the last window draws
+        gaps: draws since each number last appeared, or the number of
+            draws if it never did
+        hot_streaks: consecutive draws, up to the latest, that each
+            number appeared in
+        longest_hot: longest run of consecutive draws with each number
+        longest_cold: longest run of consecutive draws without it
+
+    A number is cold for its gap: the current cold streak.
+
+    """
+
+    def __init__(self, draws, num_range, window=None, drawn=None):
+        """draws: sequence of Draws, oldest first
+        num_range: (lowest, highest) numbers, inclusive
+        window: number of latest draws counted in window_counts, or None
+        for all of them
+        drawn: the drawn_matrix of draws, if it is already built
+        """
+        self.lowest, self.highest = num_range
+        self.draw_count = len(draws)
+        self.window = self.draw_count if window is None else window
+        if drawn is None and self.draw_count:
+            drawn = drawn_matrix(draws, num_range)
+        if drawn is not None and self.draw_count:
+            self._gather_columns(drawn)
+        else:
+            self._gather(draws)
+
+    def _gather_columns(self, drawn):
+        """Set every statistic from drawn, a NumPy array of booleans with
+        a row per draw and a column per number, a column at a time."""
+        np = load_numpy()
+        count = self.draw_count
+        self.counts = drawn.sum(axis=0).tolist()
+        window_start = max(count - self.window, 0)
+        self.window_counts = drawn[window_start:].sum(axis=0).tolist()
+        last_seen = np.where(drawn.any(axis=0),
+                             count - 1 - drawn[::-1].argmax(axis=0), -1)
+        self.gaps = (count - 1 - last_seen).tolist()
+        self.longest_hot, self.hot_streaks = column_runs(drawn)
+        # cold runs include those before the first draw of a number
+        self.longest_cold = column_runs(~drawn)[0]
+
+    def _gather(self, draws):
+        """Set every statistic from draws, a draw at a time."""
+        width = self.highest - self.lowest + 1
+        self.counts = [0] * width
+        self.window_counts = [0] * width
+        self.hot_streaks = [0] * width
+        self.longest_hot = [0] * width
+        self.longest_cold = [0] * width
+        last_seen = [-1] * width
+        in_range = range_mask((self.lowest, self.highest))
+        window_start = self.draw_count - self.window
+        for i, draw in enumerate(draws):
+            in_window = i >= window_start
+            for n in mask_numbers(draw.mask & in_range):
+                col = n - self.lowest
+                cold = i - last_seen[col] - 1
+                if cold:
+                    self.hot_streaks[col] = 1
+                    if cold > self.longest_cold[col]:
+                        self.longest_cold[col] = cold
+                else:
+                    self.hot_streaks[col] += 1
+                if self.hot_streaks[col] > self.longest_hot[col]:
+                    self.longest_hot[col] = self.hot_streaks[col]
+                self.counts[col] += 1
+                if in_window:
+                    self.window_counts[col] += 1
+                last_seen[col] = i
+        self.gaps = [self.draw_count - last - 1 for last in last_seen]
+        for col, gap in enumerate(self.gaps):
+            if gap:
+                self.hot_streaks[col] = 0  # missed the latest draw
+                self.longest_cold[col] = max(self.longest_cold[col], gap)
+
+    @property
+    def numbers(self):
+        """Return the range of numbers covered."""
+        return range(self.lowest, self.highest + 1)
+
+    def frequency(self, n):
+        """Return the fraction of draws containing n, or None if there are
+        no draws."""
+        if self.draw_count == 0:
+            return None
+        return self.counts[n - self.lowest] / self.draw_count
+
+    def window_frequency(self, n):
+        """Return the fraction of the window draws containing n, or None if
+        the window is empty."""
+        window = min(self.window, self.draw_count)
+        if window <= 0:
+            return None
+        return self.window_counts[n - self.lowest] / window
+
+    def summary(self, n):
+        """Return an ordered mapping of every statistic for number n."""
+        col = n - self.lowest
+        return OrderedDict([('number', n),
+                            ('count', self.counts[col]),
+                            ('frequency', self.frequency(n)),
+                            ('window_count', self.window_counts[col]),
+                            ('window_frequency', self.window_frequency(n)),
+                            ('gap', self.gaps[col]),
+                            ('hot_streak', self.hot_streaks[col]),
+                            ('cold_streak', self.gaps[col]),
+                            ('longest_hot', self.longest_hot[col]),
+                            ('longest_cold', self.longest_cold[col])])
+
+    def summaries(self):
+        """Return a list of the summary of every number, lowest first."""
+        return [self.summary(n) for n in self.numbers]
+
+
+def column_runs(cells):
+    """Return lists of the longest run of True cells down each column of
+    the 2D NumPy array cells, and of the run ending at its last row."""
+    np = load_numpy()
+    rows, cols = cells.shape
+    edges = np.zeros((cols, rows + 2), np.int8)  # False above and below
+    edges[:, 1:-1] = cells.T
+    steps = np.diff(edges, axis=1)
+    run_cols, starts = np.nonzero(steps == 1)
+    ends = np.nonzero(steps == -1)[1]  # in the same order as starts
+    lengths = ends - starts
+    longest = np.zeros(cols, np.int64)
+    np.maximum.at(longest, run_cols, lengths)
+    current = np.zeros(cols, np.int64)
+    at_end = ends == rows
+    current[run_cols[at_end]] = lengths[at_end]
+    return longest.tolist(), current.tolist()
+
+
+class RollingWindow(object):
+    """Per-number counts and color tallies of a sliding window of draws.
+
+    Draws enter at the end of the window in date order and leave from the
+    front.  Each draw is colored once, against the whole history, when it
+    enters.  In a chart of the window alone only the first few draws are
+    colored differently, having fewer rows above them, so just those are
+    recolored when the window moves.
+
+    """
+
+    def __init__(self, rules, num_range, drawn, not_drawn, min_history=0):
+        """Arguments are those of ColorEngine."""
+        self.history = ColorEngine(rules, num_range, drawn, not_drawn,
+                                   min_history)
+        # the compiled rules are shared with every recoloring engine
+        self.params = (self.history.rules, num_range, drawn, not_drawn,
+                       min_history)
+        self.lowest, self.highest = num_range
+        self.not_drawn = not_drawn
+        self.range_mask = range_mask(num_range)
+        # draws that may be colored differently without earlier draws
+        self.front = max(self.history.rules.depth, min_history)
+        self.entries = deque()  # [draw, colors] in date order
+        width = self.highest - self.lowest + 1
+        self.counts = [0] * width
+        self._color_counts = OrderedDict()
+        for color in self.history.rules.colors + [drawn]:
+            self._color_counts.setdefault(color, [0] * width)
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def tallies(self):
+        """Return a mapping of each color to its count in every column, as
+        ColorEngine.tallies gives for the draws of the window alone."""
+        return color_tallies(self._color_counts, len(self.entries),
+                             self.not_drawn)
+
+    def add(self, draw):
+        """Add draw, which must not be earlier than any draw added before,
+        to the end of the window."""
+        classes = self.history.classify(draw.mask)
+        self.entries.append([draw, classes])
+        self._count(draw, 1)
+        self._tally(classes, 1)
+        if len(self.entries) <= self.front:
+            self._recolor_front()
+
+    def remove(self):
+        """Remove the earliest draw from the window and return it."""
+        draw, classes = self.entries.popleft()
+        self._count(draw, -1)
+        self._tally(classes, -1)
+        self._recolor_front()
+        return draw
+
+    def roll(self, draws, weeks, step=1):
+        """Generate a snapshot() of the window over draws for every step
+        weeks, ending on the date of the last draw.
+
+        Each window holds the draws from the weeks weeks up to its end
+        date, as filter_by_cutoff_date in lotto.py selects them.  The
+        window must be empty to start with.
+
+        """
+        draws = sorted(draws, key=attrgetter('ordinal'))
+        if not draws:
+            return
+        span, stride = 7 * weeks, 7 * step
+        first, last = draws[0].ordinal, draws[-1].ordinal
+        end = last - (last - first) // stride * stride
+        entering = iter(draws)
+        pending = next(entering, None)
+        while end <= last:
+            while pending is not None and pending.ordinal <= end:
+                self.add(pending)
+                pending = next(entering, None)
+            while self.entries and self.entries[0][0].ordinal <= end - span:
+                self.remove()
+            yield self.snapshot(end)
+            end += stride
+
+    def snapshot(self, end=None):
+        """Return an ordered mapping of the window statistics, labelled
+        with the date ordinal end if given."""
+        count = len(self.entries)
+        frequencies = [c / count if count else None for c in self.counts]
+        return OrderedDict([
+            ('date', None if end is None else
+             datetime.date.fromordinal(end)),
+            ('draws', count),
+            ('counts', list(self.counts)),
+            ('frequencies', frequencies),
+            ('tallies', self.tallies)])
+
+    def _count(self, draw, sign):
+        """Add sign to the count of every number in draw."""
+        for n in mask_numbers(draw.mask & self.range_mask):
+            self.counts[n - self.lowest] += sign
+
+    def _tally(self, classes, sign):
+        """Add sign to the color count of every number in classes."""
+        for color, match in classes:
+            counts = self._color_counts[color]
+            for n in mask_numbers(match):
+                counts[n - self.lowest] += sign
+
+    def _recolor_front(self):
+        """Color the first draws of the window from the window alone."""
+        engine = ColorEngine(*self.params)
+        for entry in itertools.islice(self.entries, self.front):
+            self._tally(entry[1], -1)
+            entry[1] = engine.classify(entry[0].mask)
+            self._tally(entry[1], 1)
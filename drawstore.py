@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""SQLite store of draws, queried by game, weekday and date.
+
+The draws read from a set of CSV files are stored in one database: a row
+per draw holding its game, its position in the game's source, draw
+number, date ordinal, weekday and number bitmask.  Draws are indexed on
+(weekday, ordinal) and (game, ordinal), so selecting the draws on some
+days after a cutoff date reads only those rows, instead of scanning
+every draw ever made.
+
+The store records a signature of the files it was filled from.  While
+the files are unchanged the draws are queried from the store and the
+files are not parsed at all; otherwise every draw is replaced in one
+transaction.
+
+A connection is opened for each query rather than held, so a DrawStore
+can be shared with forked or spawned worker processes.
+
+"""
+
+import contextlib
+import hashlib
+import os
+import sqlite3
+
+from drawcore import Draw
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT);
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL);
+CREATE TABLE IF NOT EXISTS draws (
+    game INTEGER NOT NULL REFERENCES games (id),
+    seq INTEGER NOT NULL,
+    draw_num INTEGER,
+    ordinal INTEGER NOT NULL,
+    weekday INTEGER NOT NULL,
+    mask NOT NULL,
+    PRIMARY KEY (game, seq));
+CREATE INDEX IF NOT EXISTS draws_weekday_ordinal ON draws (weekday, ordinal);
+CREATE INDEX IF NOT EXISTS draws_game_ordinal ON draws (game, ordinal);
+'''
+MAX_INTEGER_BITS = 63  # SQLite integers are signed 64-bit
+
+
+def source_signature(filenames, *options):
+    """Return a digest of the paths, sizes and modification times of
+    filenames and any options that change the draws read from them."""
+    digest = hashlib.sha1(repr(options).encode('utf-8'))
+    for filename in filenames:
+        try:
+            stat = os.stat(filename)
+            state = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            state = None  # read again, to report the error
+        digest.update(repr((os.path.abspath(filename), state)).encode(
+            'utf-8'))
+    return digest.hexdigest()
+
+
+def mask_to_sql(mask):
+    """Return mask as an SQLite integer, or hex text if it is too wide."""
+    return mask if mask.bit_length() <= MAX_INTEGER_BITS else format(mask, 'x')
+
+
+def mask_from_sql(value):
+    """Return the mask stored by mask_to_sql as value."""
+    return int(value, 16) if isinstance(value, str) else value
+
+
+class DrawStore(object):
+    """A database of the draws of each game."""
+
+    def __init__(self, filename, draw_type=Draw):
+        self.filename = filename
+        self.draw_type = draw_type  # Draw subclass to return draws as
+        with self.connect() as connection:
+            connection.executescript(SCHEMA)
+
+    def connect(self):
+        """Return a context manager giving a connection to the database
+        that is closed on exit."""
+        return contextlib.closing(sqlite3.connect(self.filename))
+
+    def signature(self):
+        """Return the signature of the files the draws were stored from,
+        or None if nothing has been stored."""
+        with self.connect() as connection:
+            row = connection.execute(
+                "SELECT value FROM meta WHERE key = 'signature'").fetchone()
+        return row and row[0]
+
+    def replace(self, results, signature):
+        """Replace every stored draw with those of results, a mapping of
+        game names to lists of draws, in one transaction."""
+        with self.connect() as connection, connection:
+            connection.execute('DELETE FROM draws')
+            connection.execute('DELETE FROM games')
+            rows = []
+            for name, draws in results.items():
+                game = connection.execute(
+                    'INSERT INTO games (name) VALUES (?)', (name,)).lastrowid
+                rows.extend((game, seq, draw.draw_num, draw.ordinal,
+                             draw.weekday, mask_to_sql(draw.mask)) for
+                            seq, draw in enumerate(draws))
+            connection.executemany(
+                'INSERT INTO draws VALUES (?, ?, ?, ?, ?, ?)', rows)
+            connection.execute("INSERT OR REPLACE INTO meta VALUES "
+                               "('signature', ?)", (signature,))
+
+    def days(self):
+        """Return the set of weekdays with at least one draw."""
+        with self.connect() as connection:
+            return query_days(connection)
+
+    def select(self, days, after=None):
+        """Return a list of the draws of every game on days, sorted by
+        date, that are later than the date ordinal after if it is given.
+        Draws on the same date are in the order they were stored."""
+        with self.connect() as connection:
+            rows = connection.execute(
+                'SELECT draw_num, ordinal, mask FROM draws '
+                'WHERE weekday IN ({}) AND ordinal > ? '
+                'ORDER BY ordinal, game, seq'.format(placeholders(days)),
+                tuple(days) + (-1 if after is None else after,))
+            return [self.draw_type.from_mask(draw_num, ordinal,
+                                             mask_from_sql(mask)) for
+                    draw_num, ordinal, mask in rows]
+
+    def filter(self, days, weeks):
+        """Return the draws of each game within the last "weeks" weeks that
+        land on a day in days, as filter_results in lotto.py does.
+
+        Returns:
+            dict (str: list of Draws): draws sorted by date for each game.
+
+        """
+        with self.connect() as connection:
+            if len(query_days(connection, days)) < len(days):
+                return {}  # covered by another combination of days
+            in_days = placeholders(days)
+            last, = connection.execute(
+                'SELECT MAX(ordinal) FROM draws WHERE weekday IN ({})'.format(
+                    in_days), tuple(days)).fetchone()
+            rows = connection.execute(
+                'SELECT name, draw_num, ordinal, mask FROM draws '
+                'JOIN games ON games.id = draws.game '
+                'WHERE weekday IN ({}) AND ordinal > ? '
+                'ORDER BY game, ordinal, seq'.format(in_days),
+                tuple(days) + (last - 7 * weeks,))  # ordinals count days
+            results = {}
+            for name, draw_num, ordinal, mask in rows:
+                results.setdefault(name, []).append(self.draw_type.from_mask(
+                    draw_num, ordinal, mask_from_sql(mask)))
+            return results
+
+
+def query_days(connection, days=range(7)):
+    """Return the set of weekdays in days with at least one draw, looking
+    each one up in the weekday index rather than scanning every draw."""
+    return {day for day in days if connection.execute(
+        'SELECT EXISTS (SELECT 1 FROM draws WHERE weekday = ?)',
+        (day,)).fetchone()[0]}
+
+
+def placeholders(values):
+    """Return the SQL parameter placeholders for a list of values."""
+    return ', '.join('?' * len(values))
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""Time and memory taken by the stages of a run.
+
+Code marks its stages with stage(), which does nothing until start() is
+called.  While a profile is active each stage records its wall time and
+CPU time, and the peak memory traced by tracemalloc during the stage if
+memory tracing is on.  The operating system only reports the peak
+resident memory of the whole process, so each record holds that peak as
+it stood when the stage ended, which earlier stages may have set.
+Stages may be nested and take labels, such as the days being charted,
+which the stages inside them inherit.
+
+stop() writes the records as JSON, and optionally the statistics of a
+cProfile run and the largest tracemalloc allocations.
+
+"""
+
+from collections import OrderedDict
+import contextlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+_active = None  # the Profile recording stages, set by start()
+
+
+def start(trace_memory=False, cprofile=False):
+    """Start recording stages and return the active Profile."""
+    global _active
+    _active = Profile(trace_memory, cprofile)
+    return _active
+
+
+def active():
+    """Return the active Profile, or None if stages are not recorded."""
+    return _active
+
+
+def stage(name, **labels):
+    """Return a context manager recording the stage called name in the
+    active Profile, if there is one."""
+    if _active is None:
+        return contextlib.nullcontext()
+    return _active.stage(name, **labels)
+
+
+def stop(filename=None, cprofile_filename=None, memory_filename=None):
+    """Stop recording stages and write what was recorded to the files
+    given."""
+    global _active
+    profile, _active = _active, None
+    if profile is not None:
+        profile.close(filename, cprofile_filename, memory_filename)
+
+
+def max_rss_kb():
+    """Return the peak resident memory of this process in kilobytes, or
+    None if it is not known."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss  # macOS: bytes
+
+
+class Profile(object):
+    """A list of records of the stages of a run."""
+
+    def __init__(self, trace_memory=False, cprofile=False):
+        self.records = []
+        self.trace_memory = trace_memory
+        self.started = time.perf_counter()
+        self._stack = []  # [labels, traced peak of nested stages]
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.profiler = None
+        if cprofile:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    @contextlib.contextmanager
+    def stage(self, name, **labels):
+        """Record the time and memory taken by the body of the with
+        statement as the stage called name."""
+        context = dict(self._stack[-1][0]) if self._stack else {}
+        context.update(labels)
+        if self.trace_memory:
+            if self._stack:
+                self._stack[-1][1] = max(self._stack[-1][1],
+                                         tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self._stack.append([context, 0])
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            record = OrderedDict([
+                ('stage', name),
+                ('labels', context),
+                ('wall', time.perf_counter() - wall),
+                ('cpu', time.process_time() - cpu),
+                ('process_max_rss_kb', max_rss_kb()),
+                ('pid', os.getpid())])
+            _, nested_peak = self._stack.pop()
+            if self.trace_memory:
+                peak = max(tracemalloc.get_traced_memory()[1], nested_peak)
+                record['traced_peak_kb'] = peak // 1024
+                if self._stack:
+                    self._stack[-1][1] = max(self._stack[-1][1], peak)
+            self.records.append(record)
+
+    def summary(self):
+        """Return the count and total times of the records of each stage."""
+        totals = OrderedDict()
+        for record in self.records:
+            total = totals.setdefault(record['stage'], OrderedDict([
+                ('count', 0), ('wall', 0.0), ('cpu', 0.0)]))
+            total['count'] += 1
+            total['wall'] += record['wall']
+            total['cpu'] += record['cpu']
+        return totals
+
+    def close(self, filename=None, cprofile_filename=None,
+              memory_filename=None):
+        """Stop profiling and write the records, cProfile statistics and
+        largest memory allocations to the files given."""
+        if self.profiler is not None:
+            self.profiler.disable()
+            if cprofile_filename:
+                self.profiler.dump_stats(cprofile_filename)
+        if self.trace_memory:
+            if memory_filename:
+                snapshot = tracemalloc.take_snapshot()
+                with open(memory_filename, 'w') as f:
+                    for stat in snapshot.statistics('lineno')[:50]:
+                        f.write('{}\n'.format(stat))
+            tracemalloc.stop()
+        if filename:
+            with open(filename, 'w') as f:
+                json.dump(OrderedDict([
+                    ('wall', time.perf_counter() - self.started),
+                    ('process_max_rss_kb', max_rss_kb()),
+                    ('summary', self.summary()),
+                    ('records', self.records)]), f, indent=2)
@@ -1,17 +1,36 @@
 # -*- coding: utf-8 -*-
 
 import argparse
-from collections import namedtuple, OrderedDict
+import bisect
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import csv
 import datetime
+import functools
+import heapq
+import io
 import itertools
-import matplotlib.pyplot as plt
-from operator import itemgetter
+import json
+import multiprocessing
+from operator import attrgetter, itemgetter
 import os.path
+import re
 import string
+import struct
 import sys
+import threading
 import logging
 
+from drawcache import DrawCache
+import raster
+from drawcore import (ColorEngine, Draw, draws_digest, drawn_matrix,
+                      load_numpy, mask_numbers, range_mask, replace_file,
+                      RuleSet, WeekdayIndex)
+from drawstats import NumberStats
+from drawstore import DrawStore, source_signature
+import instrument
+import tattscsv
+
 # ----- Constants ------
 
 (MON, TUE, WED, THU, FRI, SAT, SUN) = range(7)  # same as datetime.weekday()
@@ -29,11 +48,6 @@ GREEN = '#66FF66'
 
 # ------ Classes -------
 
-class Draw(namedtuple('Draw', 'draw_num date numbers lowest highest')):
-    """A sequence of integers identified by a date and draw number."""
-    pass
-
-
 class DrawChart(object):
     """A chart containing Draws with formatting information."""
     DRAWN_STR = '•'
@@ -48,45 +62,98 @@ class DrawChart(object):
                                [(False, False, True), PINK],
                                [(False, True), BLUE],
                                [(True, ), GOLD]])
+    RULES = RuleSet(COLOR_RULES, TALLY_COLORS)
     HEADER_HEIGHT = 1
-    FOOTER_HEIGHT = 1 + len(COLOR_RULES)  # draw percentages + color tallies
+    FOOTER_HEIGHT = 1 + len(TALLY_COLORS)  # draw percentages + color tallies
 
-    def __init__(self, results, num_range):
+    def __init__(self, results, num_range, rules=None):
         self.results = results
+        self.set_rules(rules)
         self.draws = tuple(itertools.chain(*self.results.values()))
         self.lowest, self.highest = num_range
+        self.dated = self.dated_rows()
+        self.drawn = drawn_matrix([draw for _, draw in self.dated],
+                                  num_range)  # None w/o NumPy
+        self.counts = self.number_counts()
+        self._stats = None
         (self.header, self.body, self.colors, self.footer, self.width,
             self.height) = self.process()
 
+    def set_rules(self, rules):
+        """Color the chart with the RuleSet rules, or RULES if it is None,
+        with a tally row for each of its named colors."""
+        self.rules = self.RULES if rules is None else rules
+        self.FOOTER_HEIGHT = 1 + len(self.rules.names)
+
+    @property
+    def stats(self):
+        """The NumberStats of the charted draws, built on first use."""
+        if self._stats is None:
+            self._stats = NumberStats([draw for _, draw in self.dated],
+                                      (self.lowest, self.highest),
+                                      drawn=self.drawn)
+        return self._stats
+
+    def number_counts(self):
+        """Return the number of charted draws containing each number."""
+        if self.drawn is not None:
+            return self.drawn.sum(axis=0).tolist()
+        counts = [0] * (self.highest - self.lowest + 1)
+        in_range = range_mask((self.lowest, self.highest))
+        for _, draw in self.dated:
+            for n in mask_numbers(draw.mask & in_range):
+                counts[n - self.lowest] += 1
+        return counts
+
     def process(self):
         """Create chart from draws in self.results."""
         header = self.create_header()
-        body = self.create_matrix()
-        colors = self.create_color_matrix(body)
-        footer = self.create_footer(colors)
+        with instrument.stage('matrix'):
+            body = self.create_matrix()
+        with instrument.stage('color matrix'):
+            colors = self.create_color_matrix(body)
+        with instrument.stage('footer'):
+            footer = self.create_footer(colors)
         width = len(body[0])
         height = len(header) + len(body) + len(footer)
         return (header, body, colors, footer, width, height)
 
+    def dated_rows(self):
+        """Return a list of (filename, Draw) pairs sorted by date, then
+        filename within date."""
+        rows = sorted(((draw.ordinal, fn, draw) for
+                       fn, draws in self.results.items() for draw in draws),
+                      key=itemgetter(0, 1))
+        return [(fn, draw) for _, fn, draw in rows]
+
     def create_header(self):
         """Return the header rows for this chart."""
         return [['Date', 'File'] + list(range(self.lowest, self.highest + 1))]
 
     def create_matrix(self):
         """Return matrix of processed draw information."""
+        if load_numpy() is not None:
+            matrix = self.create_matrix_np()
+            if matrix is not None:
+                return matrix
+        bits = [1 << num for num in range(self.lowest, self.highest + 1)]
         matrix = []
-        for fn, draws in self.results.items():
-            for draw in draws:
-                row = [draw.date, fn]
-                row.extend([num in draw.numbers for
-                            num in range(self.lowest, self.highest + 1)])
-                matrix.append(row)
-
-        # Sort by date, then filename within date.
-        date_col, file_col = 0, 1
-        matrix.sort(key=itemgetter(date_col, file_col))
+        for fn, draw in self.dated:
+            row = [draw.date, fn]
+            row.extend([bool(draw.mask & bit) for bit in bits])
+            matrix.append(row)
         return matrix
 
+    def create_matrix_np(self):
+        """Return the same matrix as create_matrix, built from a dense
+        NumPy array of (draws x numbers) booleans shifted out of the draw
+        masks at once, or None if the numbers are too high for an int64
+        mask."""
+        if self.drawn is None:
+            return None
+        return [[draw.date, fn] + cells for
+                (fn, draw), cells in zip(self.dated, self.drawn.tolist())]
+
     def create_footer(self, colors):
         """Return footer rows for this chart."""
         return [self.draw_percentages_row()] + self.tallies_footer(colors)
@@ -99,15 +166,19 @@ class DrawChart(object):
 
     def calc_draw_percentage(self, n):
         """Return the draw percentage for number n."""
-        opps = len(self.draws)
-        if opps == 0:
+        if not self.dated:
             return ''  # number not in play (division by zero)
-        times_drawn = sum((draw.numbers.count(n) for draw in self.draws))
-        return '{:.4f}%'.format(times_drawn / opps)
+        return self.format_percentage(self.counts[n - self.lowest] /
+                                      len(self.dated))
+
+    @staticmethod
+    def format_percentage(frequency):
+        """Return the text of a draw percentage cell."""
+        return '{:.4f}%'.format(frequency)
 
     def tallies_footer(self, color_matrix):
         """Return a 2D list of strings containing color counts by column."""
-        colors, names = zip(*self.TALLY_COLORS.items())
+        colors, names = zip(*self.rules.names.items())
         tallies = [[''] * len(colors)]  # column major order
         tallies.extend([names])
         transposed = list(zip(*color_matrix))
@@ -121,7 +192,8 @@ class DrawChart(object):
         Coloring rules:
             Each cell in the area of the matrix defined by start_row,
             start_col, and has_footer is colored depending on the cells in
-            the same column in the rows above.
+            the same column in the rows above.  Rows are streamed through
+            a ColorEngine holding only the last few rows as bitmasks.
 
         Returns:
             2D list of strings/None: A 2D list of the same dimensions as
@@ -130,23 +202,18 @@ class DrawChart(object):
             GREEN).
 
         """
+        if load_numpy() is not None:
+            return self.create_color_matrix_np(body)
         start_col = self.TEXT_COLS
-        max_rule_length = max((len(rule) for rule in self.COLOR_RULES.keys()))
         width = len(body[0])
-        height = len(body)
-        transposed = list(zip(*body))
-        colors = [[WHITE for row in range(height)] for
-                  col in range(width)]  # column major order
-        for row in range(height):
-            for col in range(start_col, width):
-                if not body[row][col]:
-                    continue  # cell is empty
-                fourth_previous = max(row - max_rule_length, 0)
-                previous_cells = transposed[col][fourth_previous:row]
-                previous_cells = tuple(reversed(previous_cells))
-                colors[col][row] = self.calc_color(previous_cells,
-                                                   self.COLOR_RULES)
-        colors = list(zip(*colors))
+        engine = ColorEngine(self.rules, (self.lowest, self.highest),
+                             WHITE, WHITE)
+        bits = [1 << n for n in range(self.lowest, self.highest + 1)]
+        text_colors = [WHITE] * start_col
+        colors = []
+        for row in body:
+            mask = sum(bit for bit, cell in zip(bits, row[start_col:]) if cell)
+            colors.append(tuple(text_colors + engine.push(mask)))
         # add header and footer rows
         colors = [[WHITE for col in range(width)] for
                   row in range(self.HEADER_HEIGHT)] + colors
@@ -154,17 +221,24 @@ class DrawChart(object):
                    row in range(self.FOOTER_HEIGHT)]
         return colors
 
-    def calc_color(self, previous_cells, rules):
-        """Calculate the color for a given cell."""
-        for rule, color in rules.items():
-            if len(previous_cells) < len(rule):
-                continue
-            for check_cell, correct_cell in zip(previous_cells, rule):
-                if check_cell != correct_cell:
-                    break
-            else:
-                return color  # found a match
-        return WHITE
+    def create_color_matrix_np(self, body):
+        """Return the same matrix as create_color_matrix, computed with
+        shifted boolean arrays instead of cell by cell."""
+        np = load_numpy()
+        start_col = self.TEXT_COLS
+        width = len(body[0])
+        drawn = self.drawn
+        if drawn is None:  # numbers too high for drawn_matrix
+            drawn = np.array([row[start_col:] for row in body], dtype=bool)
+        text_colors = [WHITE] * start_col
+        colors = [tuple(text_colors + row) for row in
+                  rule_colors(drawn, self.rules, WHITE, WHITE).tolist()]
+        # add header and footer rows
+        colors = [[WHITE for col in range(width)] for
+                  row in range(self.HEADER_HEIGHT)] + colors
+        colors += [[WHITE for col in range(width)] for
+                   row in range(self.FOOTER_HEIGHT)]
+        return colors
 
     def cell_text(self):
         """Return 2D list of strings representing this chart."""
@@ -176,6 +250,62 @@ class DrawChart(object):
             cells.append(row_text)
         return self.header + cells + self.footer
 
+    def rows(self):
+        """Generate the (cell text, colors) of every row, top to bottom."""
+        return zip(self.cell_text(), self.colors)
+
+
+class ChartStream(DrawChart):
+    """A DrawChart whose rows are generated one at a time by rows(), which
+    may be called only once, instead of being held in memory."""
+
+    def __init__(self, results, num_range, rules=None):
+        self.results = results
+        self.set_rules(rules)
+        self.lowest, self.highest = num_range
+        self.header = self.create_header()
+        self.width = self.TEXT_COLS + self.highest - self.lowest + 1
+        self.height = (len(self.header) +
+                       sum(len(draws) for draws in results.values()) +
+                       self.FOOTER_HEIGHT)
+
+    def dated_rows(self):
+        """Return an iterator of (filename, Draw) pairs sorted by date,
+        then filename within date."""
+        by_file = [zip(itertools.repeat(fn),
+                       sorted(draws, key=attrgetter('ordinal'))) for
+                   fn, draws in self.results.items()]
+        return heapq.merge(*by_file, key=lambda row: (row[1].ordinal, row[0]))
+
+    def rows(self):
+        """Generate the (cell text, colors) of every row, top to bottom."""
+        white = [WHITE] * self.width
+        for row in self.header:
+            yield row, white
+        engine = ColorEngine(self.rules, (self.lowest, self.highest),
+                             WHITE, WHITE)
+        numbers = range(self.lowest, self.highest + 1)
+        in_range = range_mask((self.lowest, self.highest))
+        counts = [0] * (self.highest - self.lowest + 1)
+        text_colors = [WHITE] * self.TEXT_COLS
+        for fn, draw in self.dated_rows():
+            cells = [draw.date, fn]
+            cells.extend([self.DRAWN_STR if draw.mask >> n & 1 else
+                          self.NOT_DRAWN_STR for n in numbers])
+            for n in mask_numbers(draw.mask & in_range):
+                counts[n - self.lowest] += 1
+            yield cells, tuple(text_colors + engine.push(draw.mask))
+
+        if engine.draw_count:
+            pcts = [self.format_percentage(count / engine.draw_count) for
+                    count in counts]
+        else:
+            pcts = [''] * len(counts)  # numbers not in play
+        yield ['', 'Draw %'] + pcts, white
+        tallies = engine.tallies
+        for color, name in self.rules.names.items():
+            yield ('', name) + tuple(tallies[color]), white
+
 
 class Reader(object):
     """A reader for CSV files containing lottery data."""
@@ -185,16 +315,22 @@ class Reader(object):
     DELIMITERS = (',', ';', '\t')  # expected CSV delimiters
     MAX_DRAWN_NUMBERS = 9  # OzLotto has 7 + 2 supps
 
-    def __init__(self, filenames, use_headings, abort_on_error, num_range):
+    def __init__(self, filenames, use_headings, abort_on_error, num_range,
+                 cache=None, jobs=1):
         self.filenames = filenames
         self.use_headings = use_headings
         self.abort = abort_on_error
         self.num_range = num_range
+        self.cache = cache  # DrawCache or None
+        self.jobs = jobs  # worker processes reading files at once
 
     def read_files(self):
         """Return a dictionary mapping filenames to lists of Draws."""
         self.validate_filenames()
-        results = {fn: self.read_file(fn) for fn in self.filenames}
+        if self.jobs > 1 and len(self.filenames) > 1:
+            results = self.read_files_parallel()
+        else:
+            results = {fn: self.read_file(fn) for fn in self.filenames}
         results = process_filenames(results)
         results = {fn: draws for fn, draws in results.items() if draws}
         if len(results) < 1:
@@ -202,6 +338,27 @@ class Reader(object):
             sys.exit(1)
         return results
 
+    def read_files_parallel(self):
+        """Return a dictionary mapping filenames to lists of Draws, or None
+        for files that cannot be read, read in a pool of processes.
+
+        Workers send back each file's draws as columns of integers, which
+        pickle much faster than Draw objects.  An abort in a worker exits
+        this process when the results reach it.
+
+        """
+        workers = min(self.jobs, len(self.filenames))
+        context = None
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(workers, context) as executor:
+            columns = list(executor.map(read_columns,
+                                        itertools.repeat(self),
+                                        self.filenames))
+        return {fn: None if cols is None else
+                list(map(Draw.from_mask, *cols)) for
+                fn, cols in zip(self.filenames, columns)}
+
     def read_file(self, filename):
         """Read a CSV file of Lotto Draws.
 
@@ -210,14 +367,13 @@ class Reader(object):
 
         """
         try:
-            with open(filename, newline='') as f:
-                dialect = csv.Sniffer().sniff(f.readline(), self.DELIMITERS)
-                f.seek(0)
-                csv_reader = csv.reader(f, dialect)
-                headings_row = [h.strip() for h in csv_reader.__next__()]
-                if self.use_headings:
-                    return self.read_by_headings(csv_reader, headings_row)
-                return self.read_by_order(csv_reader)
+            if self.cache is not None:
+                parser = 'headings' if self.use_headings else 'order'
+                return self.cache.read(
+                    filename, parser, lambda: self.parse_file(filename),
+                    parse_appended=lambda offset: self.parse_file(filename,
+                                                                  offset))
+            return self.parse_file(filename)
         except IOError as err:
             print('ERROR: Cannot read from input file {}.'.format(filename))
             print(err)
@@ -225,6 +381,44 @@ class Reader(object):
                 sys.exit(1)
             return None
 
+    def parse_file(self, filename, offset=0):
+        """Return a list of every Draw parsed from a CSV file.
+
+        If offset is given, only the rows that start at or after that byte
+        offset are parsed; the headings are still read from the first row.
+
+        Files in the layout published by Tatts are parsed by tattscsv,
+        with the csv module as the fallback for anything else.
+
+        """
+        with open(filename, newline='') as f:
+            dialect = csv.Sniffer().sniff(f.readline(), self.DELIMITERS)
+            f.seek(0)
+            csv_reader = csv.reader(f, dialect)
+            headings_row = [h.strip() for h in csv_reader.__next__()]
+            if dialect.delimiter == ',' and self.in_order(headings_row):
+                draws = tattscsv.read_file(filename, Draw,
+                                           self.MAX_DRAWN_NUMBERS,
+                                           offset=offset)
+                if draws is not None:
+                    return draws
+            if offset:
+                csv_reader = csv.reader(read_lines_from(filename, offset),
+                                        dialect)
+            if self.use_headings:
+                return self.read_by_headings(csv_reader, headings_row)
+            return self.read_by_order(csv_reader)
+
+    def in_order(self, headings_row):
+        """Return True if the draw number, date and first number columns
+        are the first three, as read_by_headings would find them."""
+        if not self.use_headings:
+            return True
+        headings_lower = [h.strip().lower() for h in headings_row]
+        return headings_lower[:3] == [self.DRAW_NUM_HEADING,
+                                      self.DATE_HEADING,
+                                      self.FIRST_NUM_HEADING]
+
     def read_by_headings(self, csv_reader, headings_row):
         """Return a list of Draws read from csv_reader where column types
         are identified by the column's first cell."""
@@ -247,7 +441,6 @@ class Reader(object):
         Dates are expected to be in the format 'yyyymmdd'.
 
         """
-        lowest, highest = self.num_range
         draws = []
         for row in csv_reader:
             draw_num = int(row[draw_num_col])
@@ -259,7 +452,7 @@ class Reader(object):
                     numbers.append(int(cell))
                 elif cell != '-':  # numbers may be separated by hyphens
                     break
-            draws.append(Draw(draw_num, date, numbers, lowest, highest))
+            draws.append(Draw(draw_num, date, numbers))
         return draws
 
     def validate_filenames(self):
@@ -272,8 +465,86 @@ class Reader(object):
                 self.filenames.remove(fn)
 
 
+class ResultsIndex(object):
+    """The draws of results indexed by filename and weekday.
+
+    Filters the draws by days and weeks like filter_results, but from
+    buckets sorted when the index is built, so filtering every
+    combination of days costs about one pass over the draws in total.
+
+    """
+
+    def __init__(self, results):
+        self.indexes = OrderedDict((fn, WeekdayIndex(draws)) for
+                                   fn, draws in results.items())
+
+    def filter(self, days, weeks):
+        """Return the results within the last "weeks" weeks that land on a
+        day in days, as filter_results does.
+
+        Returns:
+            dict (str: list of Draws): draws sorted by date for each
+            filename.
+
+        """
+        cutoff = self.cutoff(days, weeks)
+        if cutoff is None:
+            return {}  # these entries will be covered by another days tuple
+        filtered = OrderedDict((fn, index.select(days, cutoff)) for
+                               fn, index in self.indexes.items())
+        return {fn: draws for fn, draws in filtered.items() if draws}
+
+    def cutoff(self, days, weeks):
+        """Return the date ordinal that the draws filtered by days and
+        weeks are later than, or None if a day in days has no draws."""
+        days_found = set()
+        for index in self.indexes.values():
+            days_found.update(index.days())
+        days_found &= set(days)
+        if len(days_found) < len(days):
+            return None
+        last = max(index.last_ordinal(days) or 0 for
+                   index in self.indexes.values())
+        return last - 7 * weeks  # ordinals count days
+
+
+class ChartCache(object):
+    """DrawCharts of the draws in a ResultsIndex, memoized by days, weeks
+    and number range, keeping the maxsize most recently used.  It may be
+    shared by threads."""
+
+    def __init__(self, index, maxsize=32, rules=None, chart_type=DrawChart):
+        self.index = index
+        self.maxsize = maxsize
+        self.rules = rules
+        self.chart_type = chart_type
+        self.charts = OrderedDict()  # key: chart, least recent first
+        self.lock = threading.Lock()  # held only to look up or store charts
+
+    def chart(self, days, weeks, num_range):
+        """Return the chart of the draws on days in the last weeks weeks,
+        or None if there are none or a day in days has no draws."""
+        key = (frozenset(days), weeks, tuple(num_range))
+        with self.lock:
+            chart = self.charts.get(key)
+            if chart is not None:
+                self.charts.move_to_end(key)
+                return chart
+        results = self.index.filter(days, weeks)
+        if not results:
+            return None  # no weeks
+        chart = self.chart_type(results, num_range, self.rules)
+        with self.lock:
+            self.charts[key] = chart
+            while len(self.charts) > self.maxsize:
+                self.charts.popitem(last=False)
+        return chart
+
+
 class Writer(object):
     """PNG Image writer for analysed lottery data."""
+    VERSION = 1  # increase when changes to the writer alter its output
+    DIGEST_KEY = 'Lotto digest'  # PNG text key holding the input digest
     DATE_COL = 0
     FILE_COL = 1
 
@@ -306,58 +577,74 @@ class Writer(object):
         self.dpi = dpi  # image resolution in dots per inch
 
     def format(self, table):
-        """Format table for output to image file."""
-        self.truncate_filenames(table)
-        rotate_footer_text(table, self.chart.FOOTER_HEIGHT)
-        self.resize_table(table)
-        self.format_text(table)
-
-    def truncate_filenames(self, table):
-        """Truncate filenames that won't fit in the file column."""
-        for (_, col), cell in table.get_celld().items():
-            if col == self.FILE_COL:
-                text = cell.get_text()
-                filename = text.get_text()
-                shortened = filename[:self.DIMS['max_filename']]
-                text.set_text(shortened)
-
-    def resize_table(self, table):
-        """Resize the pyplot cells according to Writer cell
-        dimensions."""
-        # Store width so we can restore table size after resizing cells,
-        # in case the sum of dimensions in self.dims is not 1.0.
-        initial_width = calc_table_width(table)
-
-        for (row, col), cell in table.get_celld().items():
-            self.resize_cell(cell, row, col)
-
-        # Scale table width back to original value.
-        final_width = calc_table_width(table)
-        x_scale = initial_width / final_width
-        table.scale(x_scale, 1.0)
+        """Format table for output to image file.
 
-    def resize_cell(self, cell, row, col):
-        """Resize a single cell."""
-        if row == self.chart.height - self.chart.FOOTER_HEIGHT:
-            # first row of the footer (draw percentage)
-            cell.set_height(self.DIMS['footer_height'])
-        else:
-            cell.set_height(self.DIMS['cell_height'])
-        if col == self.DATE_COL:
-            cell.set_width(self.DIMS['date_width'])
-        elif col == self.FILE_COL:
-            cell.set_width(self.DIMS['file_width'])
-        else:
-            cell.set_width(self.DIMS['num_width'])
+        Every cell is styled in a single pass.  Cells are grouped by the
+        role of their row (header, body, draw percentages or tallies) and
+        column (date, file or number), and the style of each pair of roles
+        is worked out once.
 
-    def format_text(self, table):
-        """Set font sizes and weights."""
+        """
         table.auto_set_font_size(False)
+        row_roles = self.row_roles()
+        col_roles = self.col_roles()
+        # Scale cell widths so the table keeps its initial width, in case
+        # the sum of dimensions in self.DIMS is not 1.0.
+        initial_width = sum(table[0, col].get_width() for
+                            col in range(self.chart.width))
+        final_width = sum(self.col_width(role) for role in col_roles)
+        x_scale = initial_width / final_width
+        styles = {}
         for (row, col), cell in table.get_celld().items():
-            font_size, weight = self.cell_font_size_weight(row, col)
+            roles = (row_roles[row], col_roles[col])
+            style = styles.get(roles)
+            if style is None:
+                style = styles[roles] = self.cell_style(row, col, x_scale)
+            width, height, font_size, weight, rotation, max_chars = style
+            cell.set_width(width)
+            cell.set_height(height)
             text = cell.get_text()
             text.set_fontsize(font_size)
             text.set_weight(weight)
+            if rotation:
+                text.set_rotation(rotation)
+            if max_chars is not None:
+                text.set_text(text.get_text()[:max_chars])
+
+    def row_roles(self):
+        """Return a list of the role of each row of the chart."""
+        draw_percentages = self.chart.height - self.chart.FOOTER_HEIGHT
+        roles = ['header'] * self.chart.HEADER_HEIGHT
+        roles.extend(['body'] * (draw_percentages - len(roles)))
+        roles.append('draw_percentages')
+        roles.extend(['tallies'] * (self.chart.height - len(roles)))
+        return roles
+
+    def col_roles(self):
+        """Return a list of the role of each column of the chart."""
+        roles = ['number'] * self.chart.width
+        roles[self.DATE_COL] = 'date'
+        roles[self.FILE_COL] = 'file'
+        return roles
+
+    def col_width(self, role):
+        """Return the width of a column with role, before scaling."""
+        return self.DIMS.get('{}_width'.format(role), self.DIMS['num_width'])
+
+    def cell_style(self, row, col, x_scale):
+        """Return the (width, height, font size, weight, rotation, maximum
+        text length) of the cell at (row, col)."""
+        if row == self.chart.height - self.chart.FOOTER_HEIGHT:
+            # first row of the footer (draw percentage)
+            height = self.DIMS['footer_height']
+            rotation = 270 if col >= self.chart.TEXT_COLS else 0
+        else:
+            height = self.DIMS['cell_height']
+            rotation = 0
+        width = self.col_width(self.col_roles()[col]) * x_scale
+        max_chars = self.DIMS['max_filename'] if col == self.FILE_COL else None
+        font_size, weight = self.cell_font_size_weight(row, col)
+        return width, height, font_size, weight, rotation, max_chars
 
     def cell_font_size_weight(self, row, col):
         """Return the font size and weight for the cell at (row, col)
@@ -385,11 +672,22 @@ class Writer(object):
                 font_size = self.FONT_SIZES['bullets']
         return font_size, weight
 
-    def write(self, filename):
-        """Write the results to a PNG image file."""
+    @classmethod
+    def saved_digest(cls, filename):
+        """Return the input digest stored in a PNG image file written by
+        this writer, or None if there is none."""
+        try:
+            return read_png_text(filename).get(cls.DIGEST_KEY)
+        except (IOError, ValueError):
+            return None
+
+    def write(self, filename, digest=None):
+        """Write the results to a PNG image file, storing digest in the
+        file if it is given."""
         cell_text = self.chart.cell_text()
 
         # Create axes that take up the entire area and add a table.
+        plt = load_pyplot()
         plt.figure(figsize=(self.DIMS['row_width'],
                             self.DIMS['cell_height'] * 5))
         ax = plt.axes([0, 0, 1, 1])
@@ -400,13 +698,126 @@ class Writer(object):
         self.format(table)
         ax.axis('off')  # hide the axes that come with every plot
         logging.debug('Saving {}...'.format(filename))
-        plt.savefig(filename, dpi=self.dpi, bbox_inches='tight')
-        plt.close('all')
+        metadata = {self.DIGEST_KEY: digest} if digest else None
+        try:
+            with replace_file(filename) as f:
+                plt.savefig(f, format='png', dpi=self.dpi,
+                            bbox_inches='tight', metadata=metadata)
+        finally:
+            plt.close('all')
         logging.debug('done.')
 
 
+class RasterWriter(Writer):
+    """PNG image writer that draws the chart a row at a time into pixels,
+    in a 5x7 bitmap font, with the cell proportions of Writer's images."""
+    VERSION = 1
+    LINE_COLOR = b'\x00\x00\x00'
+    CAP_HEIGHT = 0.7  # capital letter height as a fraction of font size
+    BULLET_SIZE = 0.3  # bullet diameter as a fraction of font size
+
+    def pixels(self, points, fraction):
+        """Return the number of pixels in fraction of a font size."""
+        return points / 72 * self.dpi * fraction
+
+    def layout(self):
+        """Return the pixel offsets of the chart's column and row edges."""
+        widths = [self.DIMS['date_width'], self.DIMS['file_width']]
+        widths.extend([self.DIMS['num_width']] *
+                      (self.chart.width - self.chart.TEXT_COLS))
+        heights = [self.DIMS['cell_height']] * self.chart.height
+        heights[self.chart.height - self.chart.FOOTER_HEIGHT] = (
+            self.DIMS['footer_height'])
+        # As in Writer.write, the table fills the row width and cell heights
+        # are fractions of the figure height.
+        x_scale = self.DIMS['row_width'] * self.dpi / sum(widths)
+        y_scale = self.DIMS['cell_height'] * 5 * self.dpi
+        return cell_edges(widths, x_scale), cell_edges(heights, y_scale)
+
+    def write(self, filename, digest=None):
+        """Write the results to a PNG image file, storing digest in the
+        file if it is given."""
+        logging.debug('Saving {}...'.format(filename))
+        with replace_file(filename) as f:
+            self.write_file(f, digest)
+        logging.debug('done.')
+
+    def write_file(self, f, digest=None):
+        """Write the results as a PNG image to the binary file f, storing
+        digest in the image if it is given."""
+        xs, ys = self.layout()
+        text = {self.DIGEST_KEY: digest} if digest else None
+        encoder = raster.PNGEncoder(f, xs[-1] + 1, ys[-1] + 1, text)
+        for row, (texts, colors) in enumerate(self.chart.rows()):
+            band = self.draw_row(row, texts, colors, xs, ys[row],
+                                 ys[row + 1])
+            encoder.write_rows(band.rows())
+        encoder.write_rows([self.LINE_COLOR * (xs[-1] + 1)])
+        encoder.close()
+
+    def draw_row(self, row, texts, colors, xs, top, bottom):
+        """Return a canvas of the pixel rows from top to bottom, holding
+        the chart row with the given cell texts and colors.
+
+        The image is drawn a band of pixel rows at a time, so only one
+        chart row is ever held in memory.
+
+        """
+        band = raster.Canvas(xs[-1] + 1, bottom - top,
+                             raster.hex_to_rgb(WHITE))
+        cy = (top + bottom) // 2 - top
+        for col, (text, color) in enumerate(zip(texts, colors)):
+            left, right = xs[col], xs[col + 1]
+            if color != WHITE:
+                band.fill_rect(left, 0, right - left, band.height,
+                               self.rgb(color))
+            self.draw_text(band, row, col, text, (left + right) // 2, cy)
+        for x in xs:
+            band.draw_vline(x, self.LINE_COLOR)
+        band.fill_rect(0, 0, band.width, 1, self.LINE_COLOR)
+        return band
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def rgb(color):
+        """Return the pixel bytes of a '#RRGGBB' color."""
+        return raster.hex_to_rgb(color)
+
+    def draw_text(self, canvas, row, col, text, cx, cy):
+        """Draw the text of the cell at (row, col) centred on (cx, cy)."""
+        text = str(text)
+        if not text:
+            return
+        font_size, weight = self.cell_font_size_weight(row, col)
+        if text == self.chart.DRAWN_STR:
+            radius = round(self.pixels(font_size, self.BULLET_SIZE) / 2)
+            canvas.draw_disc(cx, cy, radius, self.LINE_COLOR)
+            return
+        if col == self.FILE_COL:
+            text = text[:self.DIMS['max_filename']]
+        scale = max(1, round(self.pixels(font_size, self.CAP_HEIGHT) /
+                             raster.GLYPH_HEIGHT))
+        vertical = (row == self.chart.height - self.chart.FOOTER_HEIGHT and
+                    col >= self.chart.TEXT_COLS)
+        canvas.draw_text(text, cx, cy, scale, self.LINE_COLOR,
+                         bold=weight == 'bold', vertical=vertical)
+
+
+WRITERS = OrderedDict([('matplotlib', Writer), ('raster', RasterWriter)])
+
+
 # ----- Functions ------
 
+@functools.lru_cache(maxsize=None)
+def load_pyplot():
+    """Return matplotlib.pyplot, imported on first use with the
+    non-interactive Agg backend."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot
+    return matplotlib.pyplot
+
+
 def process_filenames(results):
     """Process filenames for output.
 
@@ -441,8 +852,8 @@ def separate_mon_wed(results, mon_wed_fn='MondayWednesdayLotto'):
     if not draws:
         return results
     del results[mon_wed_fn]
-    results['Monday'] = [d for d in draws if d.date.weekday() == MON]
-    results['Wednesday'] = [d for d in draws if d.date.weekday() == WED]
+    results['Monday'] = [d for d in draws if d.weekday == MON]
+    results['Wednesday'] = [d for d in draws if d.weekday == WED]
     return results
 
 
@@ -454,51 +865,174 @@ def date_from_str(s):
     return datetime.date(year, month, day)
 
 
+def read_columns(reader, filename):
+    """Return the draw numbers, date ordinals and masks of the draws in
+    filename as read by reader, or None if it cannot be read."""
+    draws = reader.read_file(filename)
+    if draws is None:
+        return None
+    return ([draw.draw_num for draw in draws],
+            [draw.ordinal for draw in draws],
+            [draw.mask for draw in draws])
+
+
+def read_lines_from(filename, offset):
+    """Return a list of the non-blank lines of a text file from byte
+    offset onward."""
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        text = f.read().decode()
+    return [line for line in io.StringIO(text, newline='') if line.strip()]
+
+
 def last_date(results):
     """Return the timedate.Date for the latest date in results."""
     draws = tuple(itertools.chain(*results.values()))
     if not draws:
         return None
-    return max(draws, key=lambda d: d.date).date
-
-
-def calc_table_width(table):
-    """Return the width of matplotlib table in inches."""
-    return sum((cell.get_width() for cell in table.get_celld().values()))
+    return max(draws, key=lambda d: d.ordinal).date
 
 
-def rotate_footer_text(table, n, start_col=2):
-    """Rotate the text in the -nth row of the table clockwise 90 degrees.
+def rule_colors(drawn, rules, drawn_color, not_drawn_color):
+    """Return a 2D object array of the colors of the 2D boolean array
+    drawn, colored by the RuleSet rules as in ColorEngine.
 
-    Args:
-        table (matplotlib table)
+    The state of every cell is built from the cells above it in the same
+    column with shifted arrays, then looked up in the rule tables all at
+    once.  Drawn cells that match no rule get drawn_color.
 
     """
-    row_num = sorted({row for (row, _) in table.get_celld().keys()})[-n]
-    cells = (cell for (row, col), cell in table.get_celld().items() if
-             row == row_num and col >= start_col)
-    for cell in cells:
-        text = cell.get_text()
-        text.set_rotation(270)
+    np = load_numpy()
+    height = drawn.shape[0]
+    states = np.zeros(drawn.shape, dtype=np.int64)
+    for offset in range(1, min(rules.depth, height - 1) + 1):
+        states[offset:] |= drawn[:height - offset].astype(np.int64) << (
+            offset - 1)
+
+    def palette(table):
+        return np.array([drawn_color if color is None else color for
+                         color in table], dtype=object)
+    colors = palette(rules.table(height))[states]
+    for row in range(min(rules.depth, height)):
+        # not enough previous rows for the longer rules
+        colors[row] = palette(rules.table(row))[states[row]]
+    colors[~drawn] = not_drawn_color
+    return colors
+
+
+def read_rules(filename):
+    """Return a RuleSet read from a JSON file of color rules.
+
+    The file holds a list of rules, the first matched giving the color,
+    each like {"previous": [false, true], "color": "#66CCFF", "name":
+    "Blue"}: the required state of a number in the previous draw and
+    those before it, the color of the number when it is drawn in that
+    state, and the name of the tally of that color.
+
+    Raises:
+        ValueError: if the file does not hold a list of valid rules.
 
-
-def generate_filename(days, last_date, ext='.png'):
-    """Return a unique image filename for these days and date."""
+    """
+    with open(filename) as f:
+        items = json.load(f)
+    if not isinstance(items, list) or not items:
+        raise ValueError('{} does not hold a list of rules'.format(filename))
+    rules, names = OrderedDict(), OrderedDict()
+    for i, item in enumerate(items, 1):
+        try:
+            previous, color, name = (item['previous'], item['color'],
+                                     item['name'])
+        except (KeyError, TypeError):
+            raise ValueError('rule {} in {} needs previous, color and '
+                             'name'.format(i, filename))
+        if (not isinstance(previous, list) or
+                not all(isinstance(state, bool) for state in previous)):
+            raise ValueError('previous of rule {} in {} is not a list of '
+                             'true or false'.format(i, filename))
+        if not isinstance(color, str) or not re.fullmatch(
+                r'#[0-9A-Fa-f]{6}', color):
+            raise ValueError('color of rule {} in {} is not #RRGGBB'.format(
+                i, filename))
+        rules.setdefault(tuple(previous), color.upper())
+        names.setdefault(color.upper(), str(name))
+    return RuleSet(rules, names)
+
+
+def read_png_text(filename):
+    """Return a dict of the text chunks in a PNG file."""
+    text = {}
+    with open(filename, 'rb') as f:
+        if f.read(8) != b'\x89PNG\r\n\x1a\n':
+            raise ValueError('{} is not a PNG file'.format(filename))
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                break
+            length, chunk_type = struct.unpack('>I4s', chunk_header)
+            if chunk_type == b'tEXt':
+                key, _, value = f.read(length).partition(b'\0')
+                text[key.decode('latin-1')] = value.decode('latin-1')
+                f.seek(4, os.SEEK_CUR)  # skip the CRC
+            elif chunk_type == b'IEND':
+                break
+            else:
+                f.seek(length + 4, os.SEEK_CUR)
+    return text
+
+
+def cell_edges(sizes, scale):
+    """Return the pixel offsets of the edges between cells of the given
+    sizes, where scale is the number of pixels per unit of size."""
+    edges = [0]
+    total = 0
+    for size in sizes:
+        total += size
+        edges.append(int(round(total * scale)))
+    return edges
+
+
+def results_digest(results, num_range, weeks, dpi, writer=Writer,
+                   rules=None):
+    """Return a digest of everything that determines the chart of results,
+    in the order the chart presents the draws."""
+    rows = sorted(((fn, draw) for fn, draws in results.items() for
+                   draw in draws), key=lambda row: (row[1].ordinal, row[0]))
+    params = [tuple(num_range), weeks, dpi, writer.__name__, writer.VERSION]
+    if rules is not None:
+        params.extend([tuple(rules.rules.items()),
+                       tuple(rules.names.items())])
+    return draws_digest(rows, *params)
+
+
+def generate_filename(days, last_date, ext='.png', suffix=''):
+    """Return a unique image filename for these days and date, with suffix
+    added before the extension."""
     first_day = SAT  # starting day of the week for sorting
     sorted_days = sorted(days, key=lambda d: (d - first_day) % 7)
     days_str = '_'.join((DAY_STRINGS[day] for day in sorted_days))
     date_str = str(last_date).replace('-', '_')
     filename = '_'.join((date_str, days_str))
-    return ''.join((filename, ext))
+    return ''.join((filename, suffix, ext))
+
+
+def batch_suffix(weeks=None, num_range=None):
+    """Return the filename suffix telling apart the charts of a batch by
+    weeks and number range, for those that are given."""
+    suffix = ''
+    if weeks is not None:
+        suffix += '_{}w'.format(weeks)
+    if num_range is not None:
+        suffix += '_{}-{}'.format(*num_range)
+    return suffix
 
 
 def filter_by_weekdays(results, days):
     """Return results with only the draws that fall on a day in days."""
-    filtered = {fn: [draw for draw in draws if draw.date.weekday() in days] for
+    filtered = {fn: [draw for draw in draws if draw.weekday in days] for
                 fn, draws in results.items()}
     days_found = set()
     for draws in filtered.values():
-        days_found.update({d.date.weekday() for d in draws})
+        days_found.update({d.weekday for d in draws})
     if len(days_found) < len(days):
         return {}  # these entries will be covered by another days tuple
     return filtered
@@ -509,7 +1043,8 @@ def filter_by_cutoff_date(results, weeks):
     if results == {}:
         return {}
     cutoff = last_date(results) - datetime.timedelta(weeks=weeks)
-    return {fn: [draw for draw in draws if draw.date > cutoff] for
+    cutoff = cutoff.toordinal()
+    return {fn: [draw for draw in draws if draw.ordinal > cutoff] for
             fn, draws in results.items()}
 
 
@@ -526,61 +1061,281 @@ def filter_results(results, days, weeks):
     return {fn: draws for fn, draws in filtered.items() if draws}
 
 
+def render_charts(results, num_ranges, windows, dpi, jobs=1, force=False,
+                  writer=Writer, chart_type=DrawChart, rules=None,
+                  store=None):
+    """Write an image with writer for every combination of days in
+    DAY_COMBINATIONS, number of weeks in windows and (low, high) range in
+    num_ranges, in jobs processes, reusing unchanged images unless force
+    is True.  Charts are made by chart_type and colored by rules, from
+    store instead of results if it is given.
+
+    Returns:
+        (list of str, list of str): the filenames written and the
+        filenames reused.
+
+    """
+    if store is not None:
+        index = store
+    else:
+        with instrument.stage('index'):
+            index = ResultsIndex(results)
+    state = (index, tuple(map(tuple, num_ranges)), tuple(windows), dpi,
+             force, writer, chart_type, rules)
+    outcomes = []
+    if jobs <= 1:
+        init_render_worker(*state)
+        for days in DAY_COMBINATIONS:
+            outcomes.extend(render_days(days))
+    elif instrument.active() is not None:
+        with pool_of(jobs, state) as pool:
+            for days_outcomes, records in pool.map(
+                    render_days_profiled, DAY_COMBINATIONS, chunksize=1):
+                outcomes.extend(days_outcomes)
+                instrument.active().records.extend(records)
+    else:
+        with pool_of(jobs, state) as pool:
+            for days_outcomes in pool.map(render_days, DAY_COMBINATIONS,
+                                          chunksize=1):
+                outcomes.extend(days_outcomes)
+    written = [fn for fn, reused in outcomes if fn is not None and not reused]
+    reused = [fn for fn, reused in outcomes if reused]
+    return written, reused
+
+
+def pool_of(jobs, state):
+    """Return a pool of jobs processes that call render_days with state."""
+    # Forked workers share the index with this process; otherwise each
+    # worker is sent one pickled copy when it starts.
+    if 'fork' in multiprocessing.get_all_start_methods():
+        init_render_worker(*state)  # inherited by the forked workers
+        return multiprocessing.get_context('fork').Pool(jobs)
+    return multiprocessing.Pool(jobs, init_render_worker, state)
+
+
+_render_state = None  # arguments of render_days, set by init_render_worker
+
+
+def init_render_worker(index, num_ranges, windows, dpi, force, writer,
+                       chart_type, rules):
+    """Set the ResultsIndex and options used by render_days."""
+    global _render_state
+    _render_state = (index, num_ranges, windows, dpi, force, writer,
+                     chart_type, rules)
+
+
+def render_days(days):
+    """Write the charts of the draws on days, for every window and number
+    range, to image files, except those that already hold the same chart.
+
+    Returns:
+        list of (str, bool): for each chart, the filename, or None if no
+        draws fell on days, and whether an existing file was reused.
+
+    """
+    (index, num_ranges, windows, dpi, force, writer_type, chart_type,
+        rules) = _render_state
+    day_names = ' '.join(DAY_STRINGS[day] for day in days)
+    outcomes = []
+    with instrument.stage('render', days=day_names):
+        with instrument.stage('filter'):
+            by_window = filter_windows(index, days, windows)
+        for weeks, days_results in by_window.items():
+            if len(days_results) == 0:
+                outcomes.append((None, False))
+                continue
+            for num_range in num_ranges:
+                suffix = batch_suffix(weeks if len(windows) > 1 else None,
+                                      num_range if len(num_ranges) > 1 else
+                                      None)
+                filename = generate_filename(days, last_date(days_results),
+                                             suffix=suffix)
+                outcomes.append(render_chart(
+                    filename, days_results, num_range, weeks, dpi, force,
+                    writer_type, chart_type, rules))
+    return outcomes
+
+
+def render_chart(filename, results, num_range, weeks, dpi, force,
+                 writer_type, chart_type, rules):
+    """Write the chart of results to filename, unless it already holds the
+    same chart, and return the filename and whether it was reused."""
+    with instrument.stage('digest'):
+        digest = results_digest(results, num_range, weeks, dpi, writer_type,
+                                rules)
+    if not force and writer_type.saved_digest(filename) == digest:
+        logging.debug('Reusing {}.'.format(filename))
+        return filename, True
+    if issubclass(chart_type, ChartStream):
+        # rows are made as they are written, so time them as one stage
+        with instrument.stage('chart and save'):
+            chart = chart_type(results, num_range, rules)
+            writer_type(chart, dpi).write(filename, digest)
+        return filename, False
+    with instrument.stage('chart'):
+        chart = chart_type(results, num_range, rules)
+    with instrument.stage('save'):
+        writer = writer_type(chart, dpi)
+        writer.write(filename, digest)
+    return filename, False
+
+
+def filter_windows(index, days, windows):
+    """Return an ordered mapping of each number of weeks in windows to the
+    draws on days within it, as index.filter returns them."""
+    # Every window ends on the same date, so each is the tail of the
+    # longest, found by bisection, and the index is filtered only once.
+    longest = index.filter(days, max(windows))
+    last = max((draws[-1].ordinal for draws in longest.values()),
+               default=None)
+    ordinals = {fn: [draw.ordinal for draw in draws] for
+                fn, draws in longest.items()}
+    by_window = OrderedDict()
+    for weeks in windows:
+        if last is None:
+            by_window[weeks] = {}
+            continue
+        cutoff = last - 7 * weeks  # ordinals count days
+        tails = {fn: draws[bisect.bisect_right(ordinals[fn], cutoff):] for
+                 fn, draws in longest.items()}
+        by_window[weeks] = {fn: draws for fn, draws in tails.items() if
+                            draws}
+    return by_window
+
+
+def render_days_profiled(days):
+    """Return the outcome of render_days in a worker process and the
+    records of its stages."""
+    profile = instrument.active() or instrument.start()
+    mark = len(profile.records)
+    outcomes = render_days(days)
+    return outcomes, profile.records[mark:]
+
+
 def parse_args():
     """Parse arguments and perform simple validation."""
     parser = argparse.ArgumentParser()
     parser.description = ('Process and chart lottery data. '
-                          'Requires matplotlib.')
+                          'Requires matplotlib unless the raster PNG '
+                          'renderer is used.')
     parser.add_argument('inputfiles', nargs='+',
                         help='CSV file(s) to process')
     parser.add_argument('-a', '--abort-on-error', action='store_true',
                         help='exit if an input file cannot be read')
+    parser.add_argument('-c', '--cache-dir', metavar='DIR',
+                        help='cache parsed input files in DIR and reuse '
+                             'them while the input files are unchanged')
     parser.add_argument('-u', '--use-headings', action='store_true',
                         help='read CSV columns by their headings '
                              'rather than their order')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='render every chart, even those unchanged '
+                             'since they were last written')
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                        help='read files and render charts in N worker '
+                             'processes; 0 uses one per CPU (default is 1)')
+    parser.add_argument('--store', metavar='DB',
+                        help='keep the draws in the SQLite database DB, '
+                             'read the input files again only when they '
+                             'change, and query each chart from it')
     parser.add_argument('-n', '--number-range', type=int, nargs=2,
-                        default=[1, 45], metavar=('LOW', 'HIGH'),
+                        action='append', metavar=('LOW', 'HIGH'),
                         help='the range (inclusive) of numbers that '
-                             'may be drawn (default is 1 45)')
+                             'may be drawn; repeat to chart several '
+                             'ranges (default is 1 45)')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='write the time and memory taken by each '
+                             'stage to FILE as JSON')
+    parser.add_argument('--profile-cpu', metavar='FILE',
+                        help='run under cProfile and write its statistics '
+                             'to FILE (this process only)')
+    parser.add_argument('--profile-memory', metavar='FILE',
+                        help='trace memory allocations, adding traced '
+                             'peaks to the --profile records, and write '
+                             'the largest to FILE')
+    parser.add_argument('-p', '--png-renderer', choices=list(WRITERS),
+                        default='matplotlib',
+                        help='draw images with a matplotlib table, or '
+                             'straight into a raster (default is '
+                             'matplotlib)')
     parser.add_argument('-r', '--resolution', type=int, default=120,
                         metavar='DPI',
                         help='output resolution in dots per inch '
                              '(default is 120)')
+    parser.add_argument('--rules', metavar='FILE',
+                        help='color drawn numbers by the rules in the JSON '
+                             'file FILE instead of the standard gold, blue, '
+                             'pink and green')
+    parser.add_argument('-s', '--stream', action='store_true',
+                        help='generate each chart a row at a time rather '
+                             'than holding it in memory, for very long '
+                             'histories (needs the raster PNG renderer)')
     parser.add_argument('-v', '--verbose', action='store_true',
                         help='show progress as files are created')
-    parser.add_argument('-w', '--weeks', type=int, default=104,
+    parser.add_argument('-w', '--weeks', type=int, action='append',
                         help='number of weeks to process from last '
-                             'date in inputfiles (default is 104)')
+                             'date in inputfiles; repeat to chart several '
+                             'windows (default is 104)')
 
-    # swap LOW and HIGH if necessary
+    # swap LOW and HIGH if necessary, and drop repeated ranges and weeks
     args = parser.parse_args()
-    low, high = args.number_range
-    if low > high:
-        args.number_range.reverse()
+    num_ranges = args.number_range or [[1, 45]]
+    args.number_range = list(OrderedDict.fromkeys(
+        (min(low, high), max(low, high)) for low, high in num_ranges))
+    if min(low for low, high in args.number_range) < 0:
+        parser.error('argument -n/--number-range: must not be negative')
+    args.weeks = list(OrderedDict.fromkeys(args.weeks or [104]))
+    if min(args.weeks) < 0:
+        parser.error('argument -w/--weeks: must not be negative')
+    if args.rules:
+        try:
+            args.rules = read_rules(args.rules)
+        except (IOError, ValueError) as err:
+            parser.error('argument --rules: {}'.format(err))
+    if args.stream and args.png_renderer != 'raster':
+        parser.error('argument -s/--stream: needs --png-renderer raster')
+    if args.jobs < 0:
+        parser.error('argument -j/--jobs: must not be negative')
+    if args.jobs == 0:
+        args.jobs = os.cpu_count() or 1
     return args
 
 
 def main():
     args = parse_args()
+    if args.profile or args.profile_cpu or args.profile_memory:
+        instrument.start(bool(args.profile_memory), bool(args.profile_cpu))
 
     # import all the draws from csv
     if args.verbose:
         logging.basicConfig(level=logging.DEBUG)
     logging.debug('Reading input files...')
-    reader = Reader(args.inputfiles, args.use_headings,
-                    args.abort_on_error, args.number_range)
-    draws = reader.read_files()
+    cache = DrawCache(args.cache_dir) if args.cache_dir else None
+    store = DrawStore(args.store) if args.store else None
+    signature = source_signature(args.inputfiles, args.use_headings)
+    draws = None
+    if store is not None and store.signature() == signature:
+        logging.debug('Input files unchanged since stored.')
+    else:
+        reader = Reader(args.inputfiles, args.use_headings,
+                        args.abort_on_error, args.number_range[0], cache,
+                        args.jobs)
+        with instrument.stage('read'):
+            draws = reader.read_files()
+        if store is not None:
+            with instrument.stage('store'):
+                store.replace(draws, signature)
     logging.debug('done.')
 
     # generate an image for every combination of days
-    for days in DAY_COMBINATIONS:
-        days_results = filter_results(draws, days, args.weeks)
-        if len(days_results) == 0:
-            continue
-        chart = DrawChart(days_results, args.number_range)
-        writer = Writer(chart, args.resolution)
-        filename = generate_filename(days, last_date(days_results))
-        writer.write(filename)
+    written, reused = render_charts(draws, args.number_range, args.weeks,
+                                    args.resolution, args.jobs, args.force,
+                                    WRITERS[args.png_renderer],
+                                    ChartStream if args.stream else DrawChart,
+                                    args.rules, store)
+    print('{} charts written, {} unchanged charts reused.'.format(
+        len(written), len(reused)))
+    instrument.stop(args.profile, args.profile_cpu, args.profile_memory)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""A minimal RGB raster canvas with a bitmap font and a PNG encoder.
+
+Drawing works on whole pixel runs with bytearray slice assignment, so
+filling a cell or a line of text costs one C-level copy per pixel row.
+
+"""
+
+import struct
+import zlib
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# 5x7 font for ASCII 32-126.  Each glyph is five columns, left to right,
+# with the top row in the least significant bit.
+FONT_5X7 = bytes.fromhex(
+    '0000000000' '00005f0000' '0007000700' '147f147f14' '242a7f2a12'
+    '2313086462' '3649552250' '0005030000' '001c224100' '0041221c00'
+    '082a1c2a08' '08083e0808' '0050300000' '0808080808' '0060600000'
+    '2010080402' '3e5149453e' '00427f4000' '4261514946' '2141454b31'
+    '1814127f10' '2745454539' '3c4a494930' '0171090503' '3649494936'
+    '064949291e' '0036360000' '0056360000' '0008142241' '1414141414'
+    '4122140800' '0201510906' '324979413e' '7e1111117e' '7f49494936'
+    '3e41414122' '7f4141221c' '7f49494941' '7f09090101' '3e41415132'
+    '7f0808087f' '00417f4100' '2040413f01' '7f08142241' '7f40404040'
+    '7f0204027f' '7f0408107f' '3e4141413e' '7f09090906' '3e4151215e'
+    '7f09192946' '4649494931' '01017f0101' '3f4040403f' '1f2040201f'
+    '7f2018207f' '6314081463' '0304780403' '6151494543' '00007f4141'
+    '0204081020' '41417f0000' '0402010204' '4040404040' '0001020400'
+    '2054545478' '7f48444438' '3844444420' '384444487f' '3854545418'
+    '087e090102' '081454543c' '7f08040478' '00447d4000' '2040443d00'
+    '007f102844' '00417f4000' '7c04180478' '7c08040478' '3844444438'
+    '7c14141408' '081414187c' '7c08040408' '4854545420' '043f444020'
+    '3c4040207c' '1c2040201c' '3c4030403c' '4428102844' '0c5050503c'
+    '4464544c44' '0008364100' '00007f0000' '0041360800' '08082a1c08')
+GLYPH_WIDTH = 5
+GLYPH_HEIGHT = 7
+GLYPH_ADVANCE = GLYPH_WIDTH + 1  # one column of spacing
+
+
+def glyph(ch):
+    """Return the five column bytes of the glyph for ch."""
+    code = ord(ch)
+    if not 32 <= code <= 126:
+        code = ord('?')
+    start = (code - 32) * GLYPH_WIDTH
+    return FONT_5X7[start:start + GLYPH_WIDTH]
+
+
+def hex_to_rgb(color):
+    """Return the bytes of an '#RRGGBB' color string."""
+    return bytes.fromhex(color.lstrip('#'))
+
+
+class Canvas(object):
+    """An RGB pixel buffer."""
+
+    def __init__(self, width, height, background=b'\xff\xff\xff'):
+        self.width = width
+        self.height = height
+        self.pixels = bytearray(background * (width * height))
+
+    def fill_rect(self, x, y, width, height, rgb):
+        """Fill the rectangle with top left corner (x, y), clipped to the
+        canvas, with rgb bytes."""
+        x0, y0 = max(x, 0), max(y, 0)
+        x1 = min(x + width, self.width)
+        y1 = min(y + height, self.height)
+        if x1 <= x0 or y1 <= y0:
+            return
+        run = rgb * (x1 - x0)
+        stride = self.width * 3
+        for row in range(y0, y1):
+            start = row * stride + x0 * 3
+            self.pixels[start:start + len(run)] = run
+
+    def draw_vline(self, x, rgb):
+        """Draw a one pixel wide line down the full height of column x."""
+        if not 0 <= x < self.width:
+            return
+        stride = self.width * 3
+        for channel, value in enumerate(rgb):
+            # every pixel row at once, with a stepped slice
+            column = bytes((value,)) * self.height
+            self.pixels[x * 3 + channel::stride] = column
+
+    def draw_disc(self, cx, cy, radius, rgb):
+        """Fill a circle centred on (cx, cy)."""
+        for dy in range(-radius, radius + 1):
+            half = int((radius * radius - dy * dy) ** 0.5 + 0.5)
+            self.fill_rect(cx - half, cy + dy, 2 * half + 1, 1, rgb)
+
+    def draw_text(self, text, cx, cy, scale, rgb, bold=False,
+                  vertical=False):
+        """Draw text centred on (cx, cy) with glyphs scale pixels per font
+        pixel.  Vertical text is rotated 90 degrees clockwise."""
+        length = len(text) * GLYPH_ADVANCE - 1
+        across, along = GLYPH_HEIGHT * scale, length * scale
+        if vertical:
+            x0, y0 = cx - across // 2, cy - along // 2
+        else:
+            x0, y0 = cx - along // 2, cy - across // 2
+        weight = 2 if bold else 1
+        for i, ch in enumerate(text):
+            offset = i * GLYPH_ADVANCE * scale
+            for gx, column in enumerate(glyph(ch)):
+                for gy in range(GLYPH_HEIGHT):
+                    if not column >> gy & 1:
+                        continue
+                    if vertical:
+                        x = x0 + (GLYPH_HEIGHT - 1 - gy) * scale
+                        y = y0 + offset + gx * scale
+                        self.fill_rect(x, y, scale, scale + weight - 1, rgb)
+                    else:
+                        x = x0 + offset + gx * scale
+                        y = y0 + gy * scale
+                        self.fill_rect(x, y, scale + weight - 1, scale, rgb)
+
+    def rows(self):
+        """Generate the bytes of each pixel row, top to bottom."""
+        stride = self.width * 3
+        view = memoryview(self.pixels)
+        for start in range(0, len(self.pixels), stride):
+            yield view[start:start + stride]
+
+
+class PNGEncoder(object):
+    """Write an 8-bit RGB PNG image to a binary file a row at a time."""
+
+    def __init__(self, file, width, height, text=None, level=6):
+        self.file = file
+        self.compressor = zlib.compressobj(level)
+        self.buffer = []
+        self.buffered = 0
+        file.write(PNG_SIGNATURE)
+        self.write_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height,
+                                              8, 2, 0, 0, 0))
+        for key, value in (text or {}).items():
+            self.write_chunk(b'tEXt', b'\0'.join((key.encode('latin-1'),
+                                                  value.encode('latin-1'))))
+
+    def write_chunk(self, chunk_type, data):
+        """Write one PNG chunk."""
+        self.file.write(struct.pack('>I', len(data)))
+        self.file.write(chunk_type)
+        self.file.write(data)
+        crc = zlib.crc32(data, zlib.crc32(chunk_type))
+        self.file.write(struct.pack('>I', crc))
+
+    def write_rows(self, rows):
+        """Compress and write rows of RGB pixel bytes."""
+        for row in rows:
+            self.buffer.append(self.compressor.compress(b'\0'))  # no filter
+            self.buffer.append(self.compressor.compress(row))
+            self.buffered += len(self.buffer[-1])
+            if self.buffered >= 1 << 16:
+                self.flush()
+
+    def flush(self):
+        """Write the compressed data buffered so far as an IDAT chunk."""
+        data = b''.join(self.buffer)
+        if data:
+            self.write_chunk(b'IDAT', data)
+        self.buffer = []
+        self.buffered = 0
+
+    def close(self):
+        """Finish the image."""
+        self.buffer.append(self.compressor.flush())
+        self.flush()
+        self.write_chunk(b'IEND', b'')
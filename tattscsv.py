@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""Fast parsing of draw histories in the layout published by Tatts.
+
+Tatts files are comma-separated with a heading row, then one row per draw
+of draw number, yyyymmdd date and the numbers drawn, with no quoting or
+blank cells.  Large files are parsed a column at a time with NumPy when
+it is installed: every cell is converted from its digit bytes at once,
+and the numbers of each draw are combined into its mask with one
+reduction.  Otherwise one regular expression checks the layout of the
+whole file, after which each row is split on commas with no per-cell
+checks, and dates become ordinals through a cache of the first day of
+each month.
+
+Files with anything unusual are left to the csv module: read_file()
+returns None for them.
+
+"""
+
+import calendar
+import datetime
+import re
+
+from drawcore import Draw, load_numpy
+
+DRAW_NUM_HEADINGS = (b'draw number', b'format: draw number')
+DATE_HEADING = b'draw date (yyyymmdd)'
+FIRST_NUM_HEADING = b'winning number 1'
+ROWS = re.compile(rb'(?:\d+,\d{8}(?:,\d+)*\r?\n)*(?:\d+,\d{8}(?:,\d+)*\r?)?')
+NUMPY_MIN_BYTES = 1 << 18  # smaller files are parsed faster than NumPy loads
+MAX_CELL_DIGITS = 15  # exact when converted through a float64
+EPOCH = datetime.date(1970, 1, 1).toordinal()  # NumPy day 0
+COMMA, NEWLINE, RETURN, ZERO = b',\n\r0'
+
+
+def is_tatts_header(line):
+    """Return True if line is the heading row of a Tatts file."""
+    headings = [h.strip() for h in line.lower().split(b',')]
+    return (len(headings) > 2 and headings[0] in DRAW_NUM_HEADINGS and
+            headings[1] == DATE_HEADING and headings[2] == FIRST_NUM_HEADING)
+
+
+def read_file(filename, draw_type=Draw, max_numbers=None, oldest=None,
+              offset=0):
+    """Return a list of the draws in a Tatts file, or None if it is not
+    one.
+
+    Args:
+        filename (str): the file to read
+        draw_type (class): Draw subclass to return
+        max_numbers (int): numbers read from each row, or None for all
+        oldest (int): date ordinal of the earliest draw returned
+        offset (int): byte offset of the first row to read, or 0 for the
+            row after the headings
+
+    """
+    with open(filename, 'rb') as f:
+        header = f.readline()
+        if not is_tatts_header(header):
+            return None
+        if offset:
+            f.seek(offset)
+        data = f.read()
+    return parse(data, draw_type, max_numbers, oldest)
+
+
+def parse(data, draw_type=Draw, max_numbers=None, oldest=None):
+    """Return a list of the draws in the rows of a Tatts file held in data,
+    or None if the rows are not all in the plain Tatts layout."""
+    if len(data) >= NUMPY_MIN_BYTES and load_numpy() is not None:
+        draws = parse_columns(data, draw_type, max_numbers)
+        if draws is not None:
+            if oldest is not None:
+                draws = [draw for draw in draws if draw.ordinal >= oldest]
+            return draws
+    return parse_rows(data, draw_type, max_numbers, oldest)
+
+
+def parse_rows(data, draw_type=Draw, max_numbers=None, oldest=None):
+    """Return the draws in data as parse() does, a row at a time."""
+    if ROWS.fullmatch(data) is None:
+        return None
+    last_col = None if max_numbers is None else max_numbers + 2
+    months = {}  # yyyymm: (ordinal of the day before the 1st, days)
+    bits = BitCache()
+    new_draw = draw_type.__new__
+    draws = []
+    for line in data.split(b'\n'):
+        if not line:
+            continue  # after the last newline
+        cells = line.rstrip(b'\r').split(b',')
+        date = cells[1]
+        month = months.get(date[:6])
+        if month is None:
+            month = months[date[:6]] = month_ordinals(date[:6])
+            if month is None:
+                return None
+        day = int(date[6:])
+        if not 1 <= day <= month[1]:
+            return None
+        ordinal = month[0] + day
+        if oldest is not None and ordinal < oldest:
+            continue
+        draw = new_draw(draw_type)
+        draw.draw_num = int(cells[0])
+        draw.ordinal = ordinal
+        draw.mask = sum(set(map(bits.__getitem__, cells[2:last_col])))
+        draws.append(draw)
+    return draws
+
+
+def parse_columns(data, draw_type=Draw, max_numbers=None):
+    """Return the draws in data as parse() does, converting every cell at
+    once with NumPy, or None if they cannot be converted this way."""
+    np = load_numpy()
+    raw = np.frombuffer(data, np.uint8)
+    if raw.size == 0:
+        return []
+    if raw[-1] != NEWLINE:
+        raw = np.append(raw, np.uint8(NEWLINE))
+    returns = np.flatnonzero(raw == RETURN)
+    if returns.size:
+        if returns[-1] + 1 >= raw.size or (raw[returns + 1] != NEWLINE).any():
+            return None  # a return outside a line ending
+        raw = np.delete(raw, returns)
+
+    # every cell ends at a comma or newline and holds only digits
+    ends = raw == NEWLINE
+    separators = ends | (raw == COMMA)
+    digits = ~separators
+    if (raw[digits] - ZERO > 9).any():
+        return None
+    cell_ends = np.flatnonzero(separators)
+    cell_starts = np.concatenate(([0], cell_ends[:-1] + 1))
+    lengths = cell_ends - cell_starts
+    if lengths.min() < 1 or lengths.max() > MAX_CELL_DIGITS:
+        return None
+    row_ends = np.flatnonzero(ends[cell_ends])
+    widths = np.diff(np.concatenate(([-1], row_ends)))
+    cols = int(widths[0])
+    if cols < 2 or (widths != cols).any():
+        return None  # rows of different lengths
+    if (lengths[1::cols] != 8).any():
+        return None  # not yyyymmdd dates
+
+    # the value of each cell is the sum of its digits times their places
+    cell_of = np.cumsum(separators) - separators
+    positions = np.flatnonzero(digits)
+    places = cell_ends[cell_of[positions]] - positions - 1
+    values = np.bincount(cell_of[positions],
+                         (raw[positions] - ZERO) * 10.0 ** places,
+                         cell_ends.size).astype(np.int64).reshape(-1, cols)
+
+    dates = values[:, 1]
+    year, month, day = dates // 10000, dates // 100 % 100, dates % 100
+    if ((year < datetime.MINYEAR).any() or (month < 1).any() or
+            (month > 12).any() or (day < 1).any()):
+        return None
+    months = (year - 1970) * 12 + month - 1
+    firsts = months.astype('datetime64[M]').astype('datetime64[D]')
+    nexts = (months + 1).astype('datetime64[M]').astype('datetime64[D]')
+    if (day > (nexts - firsts).astype(np.int64)).any():
+        return None
+    ordinals = firsts.astype(np.int64) + day - 1 + EPOCH
+
+    last_col = cols if max_numbers is None else min(cols, max_numbers + 2)
+    numbers = values[:, 2:last_col]
+    if numbers.shape[1] == 0:
+        masks = np.zeros(len(values), np.int64)
+    elif numbers.max() >= 63:
+        return None  # masks wider than an int64
+    else:
+        masks = np.bitwise_or.reduce(np.left_shift(1, numbers), axis=1)
+    return list(map(draw_type.from_mask, values[:, 0].tolist(),
+                    ordinals.tolist(), masks.tolist()))
+
+
+def month_ordinals(yyyymm):
+    """Return the ordinal of the day before the first of the month in
+    yyyymm and the number of days in the month, or None if it is not a
+    valid month."""
+    year, month = int(yyyymm[:4]), int(yyyymm[4:])
+    if year < datetime.MINYEAR or not 1 <= month <= 12:
+        return None
+    first = datetime.date(year, month, 1)
+    return first.toordinal() - 1, calendar.monthrange(year, month)[1]
+
+
+class BitCache(dict):
+    """A mapping of the bytes of a number to its bit in a mask."""
+
+    def __missing__(self, cell):
+        bit = self[cell] = 1 << int(cell)
+        return bit
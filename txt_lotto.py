@@ -1,9 +1,18 @@
 #!/usr/bin/python3
 
 import argparse
+from collections import OrderedDict
 import csv
 import datetime
-import urllib.request
+import io
+import re
+
+from drawcache import DrawCache
+from drawcore import (ColorEngine, Draw, draws_digest, replace_file, RuleSet,
+                      WeekdayIndex)
+from drawstore import DrawStore, source_signature
+import instrument
+import tattscsv
 
 # location of the lotto archives
 TATTS_URL = "https://tatts.com/LottoHistoricWinningNumbers/"
@@ -38,30 +47,76 @@ class Colors:
     NONE = 5
 
 
-class LottoDraw(object):
+# each rule lists the required state of a ball in the previous draw, then
+# the draws before it
+COLOR_RULES = OrderedDict([
+    ((True, True), Colors.GREEN),
+    ((True,), Colors.GOLD),
+    ((False, True), Colors.BLUE),
+    ((False, False, True), Colors.PINK),
+])
+RULES = RuleSet(COLOR_RULES)  # compiled once for every chart
+
+
+class LottoDraw(Draw):
     """
     A single lotto draw.
 
     date: the date of the draw
     numbers: a list of the numbers drawn
     """
+    __slots__ = ()
+
     @staticmethod
-    def from_csv(fname):
+    def from_csv(fname, cache=None, every_draw=False):
         """Generate lotto draws imported from the named file
 
         fname: local file name
+        cache: a DrawCache to reuse previously parsed draws from
+        every_draw: keep the draws older than OLDEST_DRAW too
         * Assumes the first row (header) can be discarded
         * Discards draws older than OLDEST_DRAW
         """
-        csvfile = open(fname, 'r', newline='')
+        oldest = None if every_draw else OLDEST_DRAW
+        if cache is None:
+            yield from LottoDraw._read_csv(fname, oldest)
+            return
+        draws = cache.read(fname, 'txt', lambda: list(LottoDraw._read_csv(fname)), LottoDraw,
+                           lambda offset: list(LottoDraw._read_csv(fname, offset=offset)))
+        if oldest is None:
+            yield from draws
+            return
+        oldest = oldest.toordinal()
+        for draw in draws:
+            if draw.ordinal >= oldest:
+                yield draw
+
+    @staticmethod
+    def _read_csv(fname, oldest=None, offset=0):
+        """Generate every lotto draw in the named file from oldest onward
+
+        offset: if given, skip to this byte offset instead of the header
+        * Files in the Tatts layout are parsed by tattscsv, others by csv
+        """
+        draws = tattscsv.read_file(fname, LottoDraw, oldest=oldest and oldest.toordinal(), offset=offset)
+        if draws is not None:
+            yield from draws
+            return
+        if offset:
+            with open(fname, 'rb') as appended:
+                appended.seek(offset)
+                csvfile = io.StringIO(appended.read().decode(), newline='')
+        else:
+            csvfile = open(fname, 'r', newline='')
         reader = csv.reader(csvfile)
-        next(reader)    # discard the first line
+        if not offset:
+            next(reader)    # discard the first line
         for row in reader:
             try:
                 # parse the date
                 date_string = row[1]
                 date_obj = datetime.date(int(date_string[0:4]), int(date_string[4:6]), int(date_string[6:8]))
-                if date_obj >= OLDEST_DRAW:
+                if oldest is None or date_obj >= oldest:
                     # collect numbers until not numbers
                     numbers = []
                     for txt in row[2:]:
@@ -71,19 +126,15 @@ class LottoDraw(object):
                             # we've run out of numbers
                             break
                     # save this draw
-                    yield LottoDraw(date_obj, numbers)
+                    draw_num = int(row[0]) if row[0].isdigit() else None
+                    yield LottoDraw(date_obj, numbers, draw_num)
             except IndexError:
                 print("IndexError in row: {}".format(row))
         csvfile.close()
 
-    def __init__(self, date, numbers):
+    def __init__(self, date, numbers, draw_num=None):
         """the date of the draw and a list of numbers drawn"""
-        self.date = date
-        self.numbers = numbers
-
-    def __lt__(self, other):
-        """this draw is less than other if the date is earlier"""
-        return self.date < other.date
+        super().__init__(draw_num, date, numbers)
 
     def __repr__(self):
         return "{} {}".format(self.date, self.numbers)
@@ -93,82 +144,65 @@ class LottoChart(object):
     """
     A sequence of lottodraws with metadata
     """
-    class ColorMap(object):
+    class ColorMap(ColorEngine):
         def __init__(self):
-            # the current draw and three before
-            self._this = self._last = self._twoback = self._threeback = None
-
-        def is_gold(self, ball):
-            return ball in self._this and ball in self._last
-
-        def is_green(self, ball):
-            return ball in self._this and ball in self._last and ball in self._twoback
+            # balls stay white until the two previous draws are known
+            super().__init__(RULES, (1, MAX_BALLS), Colors.WHITE,
+                             Colors.NONE, min_history=2)
 
-        def is_blue(self, ball):
-            return ball in self._this and ball not in self._last and ball in self._twoback
-
-        def is_pink(self, ball):
-            return ball in self._this and ball not in self._last and \
-                   ball not in self._twoback and ball in self._threeback
+        def update(self, draw):
+            """Returns a list of colors for every ball in the draw"""
+            return self.push(draw.mask)
 
-        def get_color(self, ball):
-            """Returns the constant for the mark of this ball in this draw"""
-            if ball not in self._this:
-                return Colors.NONE
-            try:
-                if self.is_green(ball):
-                    return Colors.GREEN
-                if self.is_gold(ball):
-                    return Colors.GOLD
-                if self.is_blue(ball):
-                    return Colors.BLUE
-                if self.is_pink(ball):
-                    return Colors.PINK
-            except TypeError:
-                pass
-            return Colors.WHITE
+    def __init__(self, draws, stream=False):
+        """create a chart from a list of draws
 
-        def update(self, draw):
-            """Return a list of colors for every ball in the draw"""
-
-            # push numbers onto the stack
-            self._threeback = self._twoback
-            self._twoback = self._last
-            self._last = self._this
-            self._this = draw.numbers
-
-            # a list of colors; one for every ball in the draw
-            columns = []
-            for ball in BALLS:
-                columns.append(self.get_color(ball))
-            return columns
-
-    def __init__(self, draws):
-        """create a chart from a list of draws"""
-
-        # generate the rows
-        self.rows = list()
-        colormap = self.ColorMap()
+        A streamed chart holds no rows: rows is a generator making each row
+        as it is written, and the tallies are complete once it is exhausted.
+        """
+        self.colormap = self.ColorMap()
+        self._update_tallies()
+        if stream:
+            self.rows = self._rows(draws)
+        else:
+            self.rows = list(self._rows(draws))
+
+    def _rows(self, draws):
+        """generate the rows of draws, then update the tallies"""
         for draw in draws:
-            self.rows.append({
+            yield {
                 'date': draw.date,
-                'name': LOTTO_NAME_MAP[draw.date.weekday()],
-                'colors': colormap.update(draw)
-            })
-
-        # tally the frequency of each color of each ball
-        self.tallies = {k: [0]*MAX_BALLS for k in TALLY_NAMES}
-        for row in self.rows:
-            for ball in range(MAX_BALLS):
-                color = row['colors'][ball]
-                tally = TALLY_NAMES[color]
-                self.tallies[tally][ball] += 1
+                'name': LOTTO_NAME_MAP[draw.weekday],
+                'colors': self.colormap.update(draw)
+            }
+        self._update_tallies()
+
+    def _update_tallies(self):
+        """the frequency of each color of each ball"""
+        tallies = self.colormap.tallies
+        self.tallies = {TALLY_NAMES[color]: tallies[color] for color in tallies}
+
+
+def write_chunks(file, pieces, chunk_size=1 << 16):
+    """write an iterable of strings to file in chunks of about chunk_size"""
+    chunk = []
+    size = 0
+    for piece in pieces:
+        chunk.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            file.write(''.join(chunk))
+            chunk = []
+            size = 0
+    file.write(''.join(chunk))
 
 
 class TextWriter(object):
     """
     An ascii rendering of lotto data
     """
+    MARKS = ('C', 'G', 'B', 'P', '*', ' ')  # indexed by Colors
+
     def __init__(self, chart):
         self.chart = chart
 
@@ -179,45 +213,82 @@ class TextWriter(object):
         return "{:^10} {:^15} |{}|\n".format("Date", "Game", numbers)
 
     def _footer(self):
-        """return a footer showing numbered columns"""
+        """generate a footer showing numbered columns"""
         numbers = '|'.join(['{:>3}'.format(idx) for idx in BALLS])
-        string = "{:^10} {:^15} |{}|\n\n".format("", "", numbers)
+        yield "{:^10} {:^15} |{}|\n\n".format("", "", numbers)
         for mark in TALLY_NAMES:
             tally = self.chart.tallies[mark]
             numbers = '|'.join(['{:>3}'.format(ball) for ball in tally])
-            string += "{:10} {:^15} |{}|\n".format('', mark, numbers)
-        return string
+            yield "{:10} {:^15} |{}|\n".format('', mark, numbers)
+
+    def lines(self):
+        """generate the lines of the text representation"""
+        yield self._header()
+        row_format = "{} {:^15} | {} |\n".format
+        mark = self.MARKS.__getitem__
+        for row in self.chart.rows:
+            yield row_format(row['date'], row['name'], ' | '.join(map(mark, row['colors'])))
+        # the tallies are complete once every row has been generated
+        yield from self._footer()
+
+    def write(self, file):
+        """write the text representation to an open file"""
+        write_chunks(file, self.lines())
 
     def __str__(self):
         """return a string representation of the lotto data"""
-        string = TextWriter._header()
-        for row in self.chart.rows:
-            columns = ' | '.join(map(('C', 'G', 'B', 'P', '*', ' ').__getitem__, row['colors']))
-            string += "{} {:^15} | {} |\n".format(row['date'], row['name'], columns)
-        string += self._footer()
-        return string
+        return ''.join(self.lines())
 
 
 class HTMLWriter(object):
     """
     an html rendering of chart
     """
-    template = """<html>
+    VERSION = 2  # increase when changes to the writer alter its output
+    head_template = """<html>
 <head>
+    <meta name="lotto-digest" content="{digest}">
     <style>
         table {{ border-collapse: collapse; font-size: 7pt; }}
         tr.bold {{ font-weight: bold; }}
         td {{ white-space: nowrap; border: 1px solid black; width:20px; text-align:center; }}
         .date {{ padding: 2px 5px; }}
+        td.green {{ background-color: lightgreen; }}
+        td.gold {{ background-color: gold; }}
+        td.blue {{ background-color: lightblue; }}
+        td.pink {{ background-color: pink; }}
     </style>
 </head><body>
-<h1>{title}</h1><table>\n{table}\n</table>
+<h1>{title}</h1><table>
+"""
+    tail = """
+</table>
 </body></html>
 """
+    # a table cell for each of Colors; white cells need no class
+    cells = ("<td class='green'>&bull;</td>", "<td class='gold'>&bull;</td>",
+             "<td class='blue'>&bull;</td>", "<td class='pink'>&bull;</td>",
+             "<td>&bull;</td>", "<td></td>")
 
     def __init__(self, chart, title):
         self.chart = chart
-        self.title = "_".join([LOTTO_NAME_MAP[game] for game in title])
+        self.title = self.game_title(title)
+
+    @staticmethod
+    def game_title(days):
+        """return the title of the chart of draws on days"""
+        return "_".join([LOTTO_NAME_MAP[game] for game in days])
+
+    @staticmethod
+    def saved_digest(fname):
+        """return the input digest stored in a saved chart, or None"""
+        try:
+            with open(fname) as file:
+                head = file.read(1024)
+        except IOError:
+            return None
+        match = re.search(r'<meta name="lotto-digest" content="(\w*)">', head)
+        return match.group(1) if match else None
 
     @staticmethod
     def _row_of_numbers():
@@ -227,37 +298,33 @@ class HTMLWriter(object):
         return html
 
     def _table_data(self):
-        table = ""
+        """generate a table row for each row of the chart"""
+        row_start = "<tr><td class='date'>{}</td><td class='date'>{}</td>".format
+        cell = self.cells.__getitem__
         for row in self.chart.rows:
-            table += "<tr><td class='date'>{}</td><td class='date'>{}</td>".format(row['date'], row['name'])
-            for cell in row['colors']:
-                bullet = '&bull;'
-                if cell == Colors.NONE:
-                    bullet = ''
-                bgcolor = ('lightgreen', 'gold', 'lightblue', 'pink', 'white', 'white')[cell]
-                table += "<td style='background-color: {}'>{}</td>".format(bgcolor, bullet)
-            table += "</tr>\n"
-        return table
+            yield row_start(row['date'], row['name'])
+            yield ''.join(map(cell, row['colors']))
+            yield "</tr>\n"
 
     def _tallies(self):
-        """return a footer showing numbered columns"""
-        html = ""
+        """generate a footer showing numbered columns"""
         for tally in TALLY_NAMES:
-            row = "<tr><td colspan=2>{}</td><td>".format(tally)
-            row += "</td><td>".join([str(x) for x in self.chart.tallies[tally]])
-            row += "</td></tr>"
-            html += row
-        return html
+            yield "<tr><td colspan=2>{}</td><td>{}</td></tr>".format(
+                tally, "</td><td>".join([str(x) for x in self.chart.tallies[tally]]))
+
+    def chunks(self, digest=''):
+        """generate the html document in pieces"""
+        yield self.head_template.format(title=self.title, digest=digest)
+        yield self._row_of_numbers()
+        yield from self._table_data()
+        yield self._row_of_numbers()
+        # the tallies are complete once every row has been generated
+        yield from self._tallies()
+        yield self.tail
 
-    def save(self, fname):
-        table = ""
-        table += self._row_of_numbers()
-        table += self._table_data()
-        table += self._row_of_numbers()
-        table += self._tallies()
-        html = self.template.format(title=self.title, table=table)
-        with open(fname, 'w') as file:
-            file.write(html)
+    def save(self, fname, digest=''):
+        with replace_file(fname, 'w') as file:
+            write_chunks(file, self.chunks(digest))
 
 
 if __name__ == '__main__':
@@ -265,33 +332,69 @@ if __name__ == '__main__':
 
     # parse commandline arguments
     parser = argparse.ArgumentParser('Process and Chart lottery data.')
-    parser.add_argument('-d', '--download', action='store_true', help='Download the input files from tatts.com')
+    parser.add_argument('-d', '--download', action='store_true', help='Download new draws in the input files from tatts.com')
+    parser.add_argument('-u', '--base-url', default=TATTS_URL, help='Download the input files from this URL instead')
+    parser.add_argument('-c', '--cache-dir', help='Cache parsed input files in this directory')
+    parser.add_argument('-s', '--store', metavar='DB', help='Keep the draws in this SQLite database and query every combo from it')
+    parser.add_argument('-f', '--force', action='store_true', help='Chart every combo, even if unchanged')
+    parser.add_argument('--profile', metavar='FILE', help='Write the time and memory taken by each stage to FILE as JSON')
+    parser.add_argument('--profile-cpu', metavar='FILE', help='Run under cProfile and write its statistics to FILE')
+    parser.add_argument('--profile-memory', metavar='FILE', help='Trace memory allocations and write the largest to FILE')
     args = parser.parse_args()
+    cache = DrawCache(args.cache_dir) if args.cache_dir else None
+    if args.profile or args.profile_cpu or args.profile_memory:
+        instrument.start(bool(args.profile_memory), bool(args.profile_cpu))
 
     # download lotto archives from the Internet and save to local file
     if args.download:
-        for filename in (TATTS_FILENAME, OZ_FILENAME, WEEK_FILENAME):
-            response = urllib.request.urlopen("{}{}".format(TATTS_URL, filename))
-            with open(filename, 'w') as f:
-                f.write(response.read().decode('utf-8'))
-            print("Downloaded {}".format(filename))
-
-    # load lotto data
-    ozlotto = list(LottoDraw.from_csv(OZ_FILENAME))
-    tattslotto = list(LottoDraw.from_csv(TATTS_FILENAME))
-    weeklotto = list(LottoDraw.from_csv(WEEK_FILENAME))
-
-    # put all the draws together
-    all_draws = ozlotto + tattslotto + weeklotto
-    all_draws.sort()
+        import download
+        with instrument.stage('download'):
+            fetched = download.fetch_all(args.base_url, (TATTS_FILENAME, OZ_FILENAME, WEEK_FILENAME))
+        for filename, outcome in fetched:
+            print("{} {}".format(outcome.capitalize(), filename))
+
+    # load lotto data, unless the store already holds it
+    filenames = (OZ_FILENAME, TATTS_FILENAME, WEEK_FILENAME)
+    store = DrawStore(args.store, LottoDraw) if args.store else None
+    signature = source_signature(filenames)
+    if store is not None and store.signature() == signature:
+        by_weekday = store  # selects draws with indexed queries
+    else:
+        with instrument.stage('read'):
+            games = OrderedDict((fname, list(LottoDraw.from_csv(fname, cache, every_draw=store is not None)))
+                                for fname in filenames)
+        if store is not None:
+            with instrument.stage('store'):
+                store.replace(games, signature)
+            by_weekday = store
+        else:
+            # put all the draws together
+            all_draws = [draw for draws in games.values() for draw in draws]
+            with instrument.stage('index'):
+                by_weekday = WeekdayIndex(all_draws)  # sorted by date within each day
+    after = OLDEST_DRAW.toordinal() - 1  # the store holds older draws too
 
     # chart every combo and create an index file
     with open('html/index.html', 'w') as file:
         file.write("<h1>Lapp Lotto</h1>")
+        reused = 0
         for combo in DRAW_COMBINATIONS:
-            draws = [draw for draw in all_draws if draw.date.weekday() in combo]
-            chart = LottoChart(draws)
-            writer = HTMLWriter(chart, combo)
-            writer.save('html/{}.html'.format(writer.title))
-            file.write("<p><a href='{0}.html'>{0}</a></p>".format(writer.title))
-            print(writer.title)
+            title = HTMLWriter.game_title(combo)
+            with instrument.stage('render', combo=title):
+                with instrument.stage('filter'):
+                    draws = by_weekday.select(combo, after)
+                fname = 'html/{}.html'.format(title)
+                digest = draws_digest(((None, draw) for draw in draws), title, HTMLWriter.VERSION)
+                if not args.force and HTMLWriter.saved_digest(fname) == digest:
+                    reused += 1
+                else:
+                    # a streamed chart is colored as it is written, so
+                    # charting and saving are timed as one stage
+                    with instrument.stage('chart and save'):
+                        chart = LottoChart(draws, stream=True)
+                        writer = HTMLWriter(chart, combo)
+                        writer.save(fname, digest)
+            file.write("<p><a href='{0}.html'>{0}</a></p>".format(title))
+            print(title)
+    print("{} charts written, {} unchanged charts reused".format(len(DRAW_COMBINATIONS) - reused, reused))
+    instrument.stop(args.profile, args.profile_cpu, args.profile_memory)